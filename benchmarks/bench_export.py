@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Compare pak size and export time for each compression setting.
+
+Writes a synthetic mod (a large save, .obj meshes and incompressible
+images) with tts.pak.write_pak, as Save.export does.
+Run from the repository root:  python benchmarks/bench_export.py
+"""
+import os
+import sys
+import json
+import random
+import tempfile
+import argparse
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir))
+import tts
+from bench_save_urls import make_save
+
+def make_mod(directory,objects,models,images,seed=1):
+  """Write the files of a synthetic mod, returning write_pak entries."""
+  rng=random.Random(seed)
+  entries=[]
+  filename=os.path.join(directory,'save.json')
+  with open(filename,'w') as fh:
+    json.dump(make_save(objects,5,seed),fh,indent=2)
+  entries.append((filename,'Mods/Workshop/save.json'))
+  for n in range(models):
+    filename=os.path.join(directory,'model%d.obj' % n)
+    with open(filename,'w') as fh:
+      for _ in range(20000):
+        fh.write("v %.6f %.6f %.6f\n" % (rng.random(),rng.random(),rng.random()))
+      for i in range(1,20000,3):
+        fh.write("f %d %d %d\n" % (i,i+1,i+2))
+    entries.append((filename,'Mods/Models/model%d.obj' % n))
+  for n in range(images):
+    filename=os.path.join(directory,'image%d.png' % n)
+    with open(filename,'wb') as fh:
+      fh.write(os.urandom(512*1024))
+    entries.append((filename,'Mods/Images/image%d.png' % n))
+  return entries
+
+def main():
+  parser=argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("-n","--objects",type=int,default=20000)
+  parser.add_argument("-m","--models",type=int,default=20)
+  parser.add_argument("-i","--images",type=int,default=40)
+  args=parser.parse_args()
+  tts.logger().setLevel('WARN')
+
+  with tempfile.TemporaryDirectory() as directory:
+    entries=make_mod(directory,args.objects,args.models,args.images)
+    pak=os.path.join(directory,'mod.pak')
+    settings=[('store',None)]+[('deflate',level) for level in (1,6,9)]+[('lzma',level) for level in (0,6)]
+    for compression,level in settings:
+      for jobs in sorted(set((1,os.cpu_count() or 1))):
+        stats=tts.pak.write_pak(pak,entries,{"Id":"bench","Type":"workshop"},compression=compression,level=level,jobs=jobs)
+        print("{:>7} level {:>4} {:>2} threads: {:>7.1f}MB in {:.2f}s".format(
+          compression,"-" if level is None else level,jobs,stats.size/1e6,stats.seconds))
+
+if __name__=="__main__":
+  main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Time importing a pak of many small images with 1, 4 and 8 threads.
+
+Builds a synthetic pak with tts.pak.write_pak and imports it into an
+empty library each time.
+Run from the repository root:  python benchmarks/bench_import.py
+"""
+import os
+import sys
+import time
+import shutil
+import random
+import tempfile
+import argparse
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir))
+import tts
+
+def make_pak(directory,images,models,seed=1):
+  """Write a pak of `images` small images and `models` meshes, returning its name."""
+  rng=random.Random(seed)
+  source=os.path.join(directory,'source')
+  os.makedirs(source)
+  entries=[]
+  for n in range(images):
+    filename=os.path.join(source,'image%d.png' % n)
+    with open(filename,'wb') as fh:
+      fh.write(os.urandom(rng.randint(4,64)*1024))
+    entries.append((filename,'Mods/Images/image%d.png' % n))
+  for n in range(models):
+    filename=os.path.join(source,'model%d.obj' % n)
+    with open(filename,'w') as fh:
+      for _ in range(20000):
+        fh.write("v %.6f %.6f %.6f\n" % (rng.random(),rng.random(),rng.random()))
+    entries.append((filename,'Mods/Models/model%d.obj' % n))
+  pak=os.path.join(directory,'bench.pak')
+  tts.pak.write_pak(pak,entries,{"Id":"bench","Type":"workshop"})
+  return pak
+
+def main():
+  parser=argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("-i","--images",type=int,default=3000)
+  parser.add_argument("-m","--models",type=int,default=20)
+  parser.add_argument("-r","--repeat",type=int,default=3)
+  args=parser.parse_args()
+  tts.logger().setLevel('WARN')
+
+  with tempfile.TemporaryDirectory() as directory:
+    pak=make_pak(directory,args.images,args.models)
+    print("{} files, {:.1f}MB pak".format(args.images+args.models,os.path.getsize(pak)/1e6))
+    library=os.path.join(directory,'library')
+    for jobs in (1,4,8):
+      times=[]
+      for _ in range(args.repeat):
+        shutil.rmtree(library,ignore_errors=True)
+        filesystem=tts.filesystem.FileSystem(base_path=library)
+        start=time.perf_counter()
+        assert tts.save.importPak(filesystem,pak,jobs=jobs)
+        times.append(time.perf_counter()-start)
+      print("{} threads: {:.2f}s".format(jobs,min(times)))
+
+if __name__=="__main__":
+  main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Measure how much memory each Save keeps alive.
+
+Compares a Save holding its json with dict-backed Urls (as it used to),
+a Save with keep_data=False, and a SaveSummary.
+Run from the repository root:  python benchmarks/bench_save_memory.py
+"""
+import os
+import sys
+import json
+import tempfile
+import argparse
+import tracemalloc
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir))
+import tts
+from bench_save_urls import make_save
+
+def dict_url_class():
+  """Url as it was before it had __slots__."""
+  namespace=dict((key,value) for key,value in vars(tts.Url).items()
+                 if key!='__slots__' and key not in tts.Url.__slots__)
+  return type('DictUrl',(),namespace)
+
+def measure(count,build):
+  """Bytes retained per object when count objects from build() are alive."""
+  tracemalloc.start()
+  before=tracemalloc.get_traced_memory()[0]
+  kept=[build() for _ in range(count)]
+  after=tracemalloc.get_traced_memory()[0]
+  tracemalloc.stop()
+  del kept
+  return (after-before)/count
+
+def main():
+  parser=argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("-n","--objects",type=int,default=5000)
+  parser.add_argument("-c","--count",type=int,default=10)
+  args=parser.parse_args()
+  tts.logger().setLevel('WARN')
+
+  with tempfile.TemporaryDirectory() as base:
+    filesystem=tts.filesystem.FileSystem(base)
+    filesystem.create_dirs()
+    filename=filesystem.get_workshop_path('1.json')
+    with open(filename,'w') as fh:
+      json.dump(make_save(args.objects,3),fh)
+
+    def load(keep_data):
+      return tts.Save(tts.load_json_file(filename),filename,'1',filesystem,keep_data=keep_data)
+
+    new_url=tts.save.Url
+    tts.save.Url=dict_url_class()
+    try:
+      old=measure(args.count,lambda: load(True))
+    finally:
+      tts.save.Url=new_url
+    released=measure(args.count,lambda: load(False))
+    summary=measure(args.count,lambda: load(False).summary())
+    urls=len(load(False).urls)
+
+  print("{} objects, {} urls per save, {} saves alive".format(args.objects,urls,args.count))
+  for label,size in [("json + dict Urls",old),("keep_data=False",released),("SaveSummary",summary)]:
+    print("  {:<18} {:>10.1f} KiB per save ({:.2f}x)".format(label,size/1024,old/size))
+
+if __name__=="__main__":
+  main()
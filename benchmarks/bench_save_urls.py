@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Compare get_save_urls against the old recursive implementation.
+
+Builds synthetic saves of nested bags/decks and times both extractors.
+Run from the repository root:  python benchmarks/bench_save_urls.py
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir))
+import tts
+
+def recursive_get_save_urls(savedata):
+  """get_save_urls as it was before it was made iterative."""
+  def parse_list(data):
+    urls=set()
+    for item in data:
+      urls |= recursive_get_save_urls(item)
+    return urls
+  def parse_dict(data):
+    urls=set()
+    if not data:
+      return urls
+    for key in data:
+      if type(data[key]) is not str or key=='PageURL' or key=='Rules':
+        continue
+      if key.endswith('URL') and data[key]!='':
+        urls.add(data[key])
+        continue
+      protocols=data[key].split('://')
+      if len(protocols)==1:
+        continue
+      if protocols[0] in ['http','https','ftp']:
+        urls.add(data[key])
+        continue
+    for item in data.values():
+      urls |= recursive_get_save_urls(item)
+    return urls
+
+  if type(savedata) is list:
+    return parse_list(savedata)
+  if type(savedata) is dict:
+    return parse_dict(savedata)
+  return set()
+
+def make_object(rng,n):
+  return {
+    "Name":"Card",
+    "Nickname":"Card %d" % n,
+    "Description":"See https://example.com/rules/%d" % (n%50),
+    "Transform":{"posX":rng.random(),"posY":rng.random(),"posZ":rng.random()},
+    "CustomImage":{"ImageURL":"http://cloud-3.steamusercontent.com/ugc/%d/" % (n%2000),
+                   "ImageSecondaryURL":""},
+    "CustomMesh":{"MeshURL":"http://imgur.com/%d.obj" % (n%300)},
+    "ContainedObjects":[]
+  }
+
+def make_save(objects,depth,seed=1):
+  """A save with `objects` objects, packed into bags nested `depth` deep."""
+  rng=random.Random(seed)
+  states=[]
+  bag=None
+  for n in range(objects):
+    if n%(objects//100 or 1)==0:
+      # start a new chain of nested bags
+      bag=make_object(rng,n)
+      states.append(bag)
+      for level in range(depth):
+        inner=make_object(rng,n+level)
+        bag["ContainedObjects"].append(inner)
+        bag=inner
+    bag["ContainedObjects"].append(make_object(rng,n))
+  return {"SaveName":"Synthetic","TabletStates":{"1":{"PageURL":"http://example.com/"}},"ObjectStates":states}
+
+def best_of(repeat,function,*args):
+  times=[]
+  for _ in range(repeat):
+    start=time.perf_counter()
+    result=function(*args)
+    times.append(time.perf_counter()-start)
+  return min(times),result
+
+def main():
+  parser=argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("-n","--objects",type=int,default=100000)
+  parser.add_argument("-r","--repeat",type=int,default=5)
+  args=parser.parse_args()
+  tts.logger().setLevel('WARN')
+
+  for depth in [1,20,200]:
+    save=make_save(args.objects,depth)
+    old_time,old_urls=best_of(args.repeat,recursive_get_save_urls,save)
+    new_time,new_urls=best_of(args.repeat,tts.save.get_save_urls,save)
+    assert old_urls==new_urls, "implementations disagree"
+    print("{:>7} objects, depth {:>3}: recursive {:.3f}s, iterative {:.3f}s ({:.2f}x), {} urls".format(
+      args.objects,depth,old_time,new_time,old_time/new_time,len(new_urls)))
+
+  # A single chain of bags deeper than the recursion limit.
+  deep=make_save(2000,sys.getrecursionlimit())
+  try:
+    recursive_get_save_urls(deep)
+    print("recursive: deep save OK")
+  except RecursionError:
+    print("recursive: RecursionError on a save nested {} deep".format(sys.getrecursionlimit()))
+  print("iterative: {} urls from the same save".format(len(tts.save.get_save_urls(deep))))
+
+if __name__=="__main__":
+  main()
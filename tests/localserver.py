@@ -0,0 +1,100 @@
+"""A local stand-in HTTP server for the download tests."""
+import re
+import time
+import threading
+import collections
+import http.server
+import urllib.parse
+
+class LocalServer:
+  """Serves `files` (path -> bytes) over keep-alive HTTP on 127.0.0.1.
+
+  Every file has an ETag, which If-None-Match is checked against, and
+  Range requests are honoured. Also acts as a proxy for its own urls.
+  Counts the requests for each path, and records the (method,path) of
+  each request in order, the Range headers seen, and the connections
+  opened. `errors` maps a path to the statuses to answer its
+  next requests with. Set `ignore_range` to answer ranges in full,
+  `wrong_range` to answer them from byte 0, and `delay` to slow every
+  response down.
+  """
+  def __init__(self,files=None):
+    self.files=dict(files or {})
+    self.errors={}
+    self.hits=collections.Counter()
+    self.requests=[]
+    self.ranges=[]
+    self.connections=0
+    self.ignore_range=False
+    self.wrong_range=False
+    self.delay=0
+    self._lock=threading.Lock()
+    server=self
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+      protocol_version='HTTP/1.1'
+
+      def setup(self):
+        super().setup()
+        with server._lock:
+          server.connections+=1
+
+      def log_message(self,*args):
+        pass
+
+      def do_HEAD(self):
+        self.respond(False)
+
+      def do_GET(self):
+        self.respond(True)
+
+      def respond(self,body):
+        # A proxy is sent the whole url.
+        path=urllib.parse.urlsplit(self.path).path
+        with server._lock:
+          server.hits[path]+=1
+          server.requests.append((self.command,path))
+          server.ranges.append(self.headers.get('Range'))
+          errors=server.errors.get(path)
+          status=errors.pop(0) if errors else None
+        time.sleep(server.delay)
+        if status or path not in server.files:
+          self.send_response(status or 404)
+          self.send_header('Content-Length','0')
+          self.end_headers()
+          return
+        data=server.files[path]
+        etag='"%d"' % len(data)
+        if self.headers.get('If-None-Match')==etag:
+          self.send_response(304)
+          self.send_header('ETag',etag)
+          self.end_headers()
+          return
+        start=0
+        match=re.match(r'bytes=(\d+)-$',self.headers.get('Range') or '')
+        if match and not server.ignore_range:
+          start=0 if server.wrong_range else int(match.group(1))
+          self.send_response(206)
+          self.send_header('Content-Range','bytes %d-%d/%d' % (start,len(data)-1,len(data)))
+        else:
+          self.send_response(200)
+        self.send_header('ETag',etag)
+        self.send_header('Content-Length',str(len(data)-start))
+        self.end_headers()
+        if body:
+          self.wfile.write(data[start:])
+
+    self.httpd=http.server.ThreadingHTTPServer(('127.0.0.1',0),Handler)
+    self.httpd.daemon_threads=True
+    self.thread=threading.Thread(target=self.httpd.serve_forever,daemon=True)
+
+  def url(self,path):
+    return 'http://127.0.0.1:%d%s' % (self.httpd.server_port,path)
+
+  def __enter__(self):
+    self.thread.start()
+    return self
+
+  def __exit__(self,*args):
+    self.httpd.shutdown()
+    self.httpd.server_close()
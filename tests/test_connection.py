@@ -0,0 +1,39 @@
+import unittest
+import tts
+from .localserver import LocalServer
+
+class ConnectionPoolTest(unittest.TestCase):
+  def test_reuses_connections(self):
+    with LocalServer({'/a':b'a'*1000,'/b':b'b'*50000}) as server:
+      pool=tts.connection.ConnectionPool()
+      for path in ['/a','/b','/a','/b','/a']:
+        with pool.open(server.url(path)) as response:
+          self.assertEqual(response.read(),server.files[path])
+      pool.close()
+    self.assertEqual(pool.stats['requests'],5)
+    self.assertEqual(pool.stats['opened'],1)
+    self.assertEqual(pool.stats['reused'],4)
+    self.assertEqual(server.connections,1)
+
+  def test_unread_body_is_not_reused(self):
+    with LocalServer({'/a':b'a'*500000}) as server:
+      pool=tts.connection.ConnectionPool()
+      for _ in range(2):
+        with pool.open(server.url('/a')) as response:
+          response.read(10)
+      pool.close()
+    self.assertEqual(pool.stats['opened'],2)
+    self.assertEqual(pool.stats['reused'],0)
+
+  def test_error_status_keeps_connection(self):
+    with LocalServer({'/a':b'a'}) as server:
+      pool=tts.connection.ConnectionPool()
+      with self.assertRaises(tts.connection.urllib.error.HTTPError):
+        pool.open(server.url('/missing'))
+      self.assertEqual(pool.content_length(server.url('/a')),1)
+      pool.close()
+    self.assertEqual(pool.stats['opened'],1)
+    self.assertEqual(server.connections,1)
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,138 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import unittest.mock
+import tts
+from .localserver import LocalServer
+
+BODY=bytes(range(256))*400
+
+class DownloadTest(unittest.TestCase):
+  def setUp(self):
+    self.directory=tempfile.mkdtemp()
+    self.filesystem=tts.filesystem.FileSystem(base_path=self.directory)
+    self.filesystem.create_dirs()
+    self.pool=tts.connection.ConnectionPool()
+    self.server=LocalServer({'/model':BODY}).__enter__()
+
+  def tearDown(self):
+    self.pool.close()
+    self.server.__exit__()
+    shutil.rmtree(self.directory)
+
+  def url(self,path='/model'):
+    return tts.Url(self.server.url(path),self.filesystem)
+
+  def write_partial(self,received):
+    url=self.url()
+    tempname=self.filesystem.get_partial_path(url.stripped_url+'.part')
+    os.makedirs(os.path.dirname(tempname),exist_ok=True)
+    with open(tempname,'wb') as fh:
+      fh.write(BODY[:received])
+    tts.url.save_partial_info(tempname,{'url':url.url,'etag':'"%d"' % len(BODY),'last_modified':None,'received':received})
+    return tempname
+
+  def assertDownloaded(self,url):
+    self.assertTrue(url.exists)
+    with open(url.location,'rb') as fh:
+      self.assertEqual(fh.read(),BODY)
+
+  def test_download(self):
+    url=self.url()
+    self.assertTrue(url.download(self.pool))
+    self.assertDownloaded(url)
+    self.assertTrue(url.download(self.pool))
+    self.assertEqual(self.server.hits['/model'],1)
+
+  def test_resume(self):
+    tempname=self.write_partial(1000)
+    url=self.url()
+    self.assertTrue(url.download(self.pool))
+    self.assertEqual(self.server.ranges,['bytes=1000-'])
+    self.assertDownloaded(url)
+    self.assertFalse(os.path.exists(tempname))
+    self.assertFalse(os.path.exists(tempname+'.json'))
+
+  def test_ignored_range_fetches_in_full(self):
+    self.server.ignore_range=True
+    self.write_partial(1000)
+    url=self.url()
+    self.assertTrue(url.download(self.pool))
+    self.assertEqual(self.server.hits['/model'],1)
+    self.assertDownloaded(url)
+
+  def test_wrong_range_fetches_in_full(self):
+    self.server.wrong_range=True
+    self.write_partial(1000)
+    url=self.url()
+    self.assertTrue(url.download(self.pool))
+    self.assertEqual(self.server.ranges,['bytes=1000-',None])
+    self.assertDownloaded(url)
+
+  def test_non_http_url(self):
+    # urllib handles these, like ftp, with a response without HTTP headers.
+    filename=os.path.join(self.directory,'source.obj')
+    with open(filename,'wb') as fh:
+      fh.write(BODY)
+    url=tts.Url('file://'+filename,self.filesystem)
+    self.assertTrue(url.download(self.pool))
+    self.assertDownloaded(url)
+    self.assertIsNone(self.filesystem.validators().get(url.stripped_url))
+
+  def test_single_flight(self):
+    self.server.delay=0.5
+    urls=[self.url() for _ in range(16)]
+    results=[None]*len(urls)
+    def download(n):
+      results[n]=urls[n].download(self.pool)
+    threads=[threading.Thread(target=download,args=(n,)) for n in range(len(urls))]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(results,[True]*len(urls))
+    self.assertEqual(self.server.hits['/model'],1)
+    for url in urls:
+      self.assertDownloaded(url)
+
+  def test_single_flight_failure(self):
+    self.server.delay=0.5
+    urls=[self.url('/missing') for _ in range(4)]
+    threads=[threading.Thread(target=url.download,args=(self.pool,)) for url in urls]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(self.server.hits['/missing'],1)
+    self.assertEqual([url.last_error for url in urls],['http 404']*len(urls))
+    self.assertEqual(tts.url._flights,{})
+
+  def test_refresh(self):
+    url=self.url()
+    self.assertTrue(url.download(self.pool))
+    self.assertTrue(url.download(self.pool,refresh=True))
+    self.assertTrue(url.unchanged)
+    self.server.files['/model']=BODY*2
+    self.assertTrue(url.download(self.pool,refresh=True))
+    self.assertFalse(url.unchanged)
+    with open(url.location,'rb') as fh:
+      self.assertEqual(fh.read(),BODY*2)
+    self.assertEqual(self.server.hits['/model'],3)
+
+  def test_refresh_through_proxy(self):
+    url=self.url()
+    self.assertTrue(url.download(self.pool))
+    dead_urls=tts.deadurls.DeadUrls(os.path.join(self.directory,'dead.json'))
+    downloader=tts.download.Downloader(pool=self.pool,dead_urls=dead_urls,refresh=True)
+    # The server proxies for itself, so the request goes through urllib.
+    with unittest.mock.patch.dict(os.environ,{'http_proxy':self.server.url(''),'no_proxy':''}):
+      results=downloader.download([self.url()])
+    self.assertEqual(results[url.url],tts.download.DownloadStatus.unchanged)
+    self.assertIsNone(dead_urls.entry(url.url))
+    self.assertEqual(self.server.hits['/model'],2)
+    self.assertEqual(self.pool.stats['requests'],1)
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import unittest
+import tts
+from .localserver import LocalServer
+
+class DownloaderTest(unittest.TestCase):
+  def setUp(self):
+    self.directory=tempfile.mkdtemp()
+    self.filesystem=tts.filesystem.FileSystem(base_path=self.directory)
+    self.filesystem.create_dirs()
+    self.pool=tts.connection.ConnectionPool()
+    self.server=LocalServer().__enter__()
+    self.dead_urls_filename=os.path.join(self.directory,'dead.json')
+
+  def tearDown(self):
+    self.pool.close()
+    self.server.__exit__()
+    shutil.rmtree(self.directory)
+
+  def url(self,path):
+    return tts.Url(self.server.url(path),self.filesystem)
+
+  def downloader(self,**kwargs):
+    dead_urls=tts.deadurls.DeadUrls(self.dead_urls_filename)
+    return tts.download.Downloader(pool=self.pool,dead_urls=dead_urls,retry_delay=0.01,**kwargs)
+
+  def test_dead_urls_are_skipped(self):
+    self.server.files['/model']=b'v 0 0 0\n'
+    downloader=self.downloader()
+    url=self.url('/missing')
+    results=downloader.download([url,self.url('/model')])
+    self.assertEqual(results[url.url],tts.download.DownloadStatus.failed)
+    self.assertEqual(downloader.dead_urls.entry(url.url)['failure'],'http 404')
+    self.assertEqual(self.server.hits['/missing'],1)
+    self.assertEqual(results.summary(),"1 downloaded, 0 already present, 1 failed.")
+
+    results=self.downloader().download([self.url('/missing'),self.url('/model')])
+    self.assertEqual(results[url.url],tts.download.DownloadStatus.skipped)
+    self.assertEqual(self.server.hits['/missing'],1)
+    self.assertFalse(results.successful)
+    self.assertEqual(results.summary(),"0 downloaded, 1 already present, 0 failed, 1 skipped as known dead (see --retry-dead).")
+
+    self.downloader(retry_dead=True).download([self.url('/missing')])
+    self.assertEqual(self.server.hits['/missing'],2)
+    self.assertEqual(self.downloader().dead_urls.entry(url.url)['attempts'],2)
+
+  def test_transient_failure_is_retried(self):
+    self.server.files['/model']=b'v 0 0 0\n'
+    self.server.errors['/model']=[503,503]
+    url=self.url('/model')
+    results=self.downloader(retries=2).download([url])
+    self.assertEqual(results[url.url],tts.download.DownloadStatus.downloaded)
+    self.assertEqual(self.server.hits['/model'],3)
+
+  def test_retries_run_out(self):
+    self.server.files['/model']=b'v 0 0 0\n'
+    self.server.errors['/model']=[503,503,503]
+    downloader=self.downloader(retries=1)
+    url=self.url('/model')
+    results=downloader.download([url])
+    self.assertEqual(results[url.url],tts.download.DownloadStatus.failed)
+    self.assertEqual(self.server.hits['/model'],2)
+    self.assertEqual(downloader.dead_urls.entry(url.url)['failure'],'http 503')
+
+  def test_read_timeout(self):
+    self.server.files['/model']=b'v 0 0 0\n'
+    self.server.delay=1
+    self.pool=tts.connection.ConnectionPool(read_timeout=0.2)
+    downloader=self.downloader(retries=0)
+    url=self.url('/model')
+    results=downloader.download([url])
+    self.assertEqual(results[url.url],tts.download.DownloadStatus.failed)
+    self.assertEqual(downloader.dead_urls.entry(url.url)['failure'],'timeout')
+
+  def test_breaker_gives_up_on_host(self):
+    urls=[self.url('/model%d' % n) for n in range(5)]
+    for n in range(5):
+      self.server.errors['/model%d' % n]=[503]
+    results=self.downloader(workers=1,retries=0,breaker_threshold=2).download(urls)
+    self.assertEqual(results.failed,[url.url for url in urls])
+    self.assertEqual(sum(self.server.hits.values()),2)
+
+  def downloaded(self):
+    return [path for method,path in self.server.requests if method=='GET']
+
+  def test_images_first(self):
+    paths=['/big.obj','/small.obj','/thing','/picture.png']
+    for path in paths:
+      self.server.files[path]=b'v 0 0 0\n'*(1000 if path=='/big.obj' else 1)
+    self.downloader(workers=1).download([self.url(path) for path in paths])
+    self.assertEqual(self.downloaded(),['/picture.png','/thing','/big.obj','/small.obj'])
+
+  def test_smallest_first(self):
+    paths=['/big.obj','/medium.obj','/small.obj']
+    for n,path in enumerate(paths):
+      self.server.files[path]=b'v 0 0 0\n'*(1000//(n+1))
+    self.downloader(workers=1,probe_sizes=True).download([self.url(path) for path in paths])
+    self.assertEqual(self.downloaded(),['/small.obj','/medium.obj','/big.obj'])
+
+  def test_prioritise(self):
+    owners={}
+    urls=[]
+    for ident,path in [('A','/a.png'),('B','/b.obj'),('C','/c.obj'),('B','/b.png')]:
+      self.server.files[path]=b'v 0 0 0\n'
+      url=self.url(path)
+      urls.append(url)
+      owners[url.url]=[ident]
+    downloader=self.downloader(workers=1)
+    downloader.prioritise('C')
+    downloader.prioritise('B')
+    downloader.download(urls,owners)
+    self.assertEqual(self.downloaded(),['/b.png','/b.obj','/c.obj','/a.png'])
+
+if __name__=='__main__':
+  unittest.main()
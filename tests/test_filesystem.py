@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+import tts
+
+URL='http://example.com/asset'
+
+class IndexTest(unittest.TestCase):
+  def setUp(self):
+    self.directory=tempfile.mkdtemp()
+    self.filesystem=tts.filesystem.FileSystem(base_path=self.directory)
+    self.filesystem.create_dirs()
+    self.stripped=tts.strip_filename(URL)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def touch(self,filename):
+    with open(filename,'wb') as fh:
+      fh.write(b'x')
+    return filename
+
+  def test_lookup(self):
+    self.assertIsNone(self.filesystem.find_image(URL))
+    self.assertEqual(self.filesystem.find_details(URL),(None,None))
+    model=self.touch(self.filesystem.get_model_path(self.stripped+'.obj'))
+    jpg=self.touch(self.filesystem.get_image_path(self.stripped+'.jpg'))
+    png=self.touch(self.filesystem.get_image_path(self.stripped+'.png'))
+    self.filesystem.refresh_index()
+    self.assertEqual(self.filesystem.find_image(URL),png)
+    self.assertEqual(self.filesystem.find_details(URL),(png,True))
+    # The image hides the model in the index, but it can still be found.
+    self.assertEqual(self.filesystem.find_model(URL),model)
+    os.remove(png)
+    self.filesystem.refresh_index()
+    self.assertEqual(self.filesystem.find_image(URL),jpg)
+
+  def test_resolve_many(self):
+    model=self.touch(self.filesystem.get_model_path(self.stripped+'.obj'))
+    resolutions=self.filesystem.resolve_many([URL,'http://example.com/missing'])
+    self.assertEqual(resolutions[0],tts.filesystem.Resolution(URL,self.stripped,model,False))
+    self.assertEqual(resolutions[1].location,None)
+
+  def test_index_file(self):
+    self.assertIsNone(self.filesystem.find_image(URL))
+    filename=self.touch(self.filesystem.get_image_path(self.stripped+'.png'))
+    self.filesystem.index_file(filename)
+    self.assertEqual(self.filesystem.find_image(URL),filename)
+
+  def test_changes_are_noticed(self):
+    self.assertIsNone(self.filesystem.find_image(URL))
+    filename=self.touch(self.filesystem.get_image_path(self.stripped+'.png'))
+    # The directories aren't checked again until INDEX_CHECK_INTERVAL has passed.
+    self.assertIsNone(self.filesystem.find_image(URL))
+    with unittest.mock.patch('tts.filesystem.INDEX_CHECK_INTERVAL',-1):
+      self.assertEqual(self.filesystem.find_image(URL),filename)
+      os.remove(filename)
+      self.assertIsNone(self.filesystem.find_image(URL))
+      with unittest.mock.patch('tts.filesystem.FileSystem.refresh_index') as refresh_index:
+        self.filesystem.find_image(URL)
+      refresh_index.assert_not_called()
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,93 @@
+import os
+import json
+import codecs
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+import tts
+
+SAVE=r'''{
+  "SaveName": "Streamed \"save\"",
+  "Rules": "see http://example.com/rules",
+  "ObjectStates": [
+    {
+      "Name": "Custom_Model",
+      "CustomMesh": {
+        "MeshURL": "http:\/\/example.com\/mesh.obj",
+        "DiffuseURL": "http://example.com/café.png",
+        "NormalURL": "",
+        "ColliderURL": null,
+        "Convex": true,
+        "MaterialIndex": 3
+      },
+      "Description": "https://example.com/described",
+      "Nickname": "not a url",
+      "Tags": ["http://example.com/in-a-list"],
+      "PageURL": "http://example.com/page",
+      "Notes": "ftp://example.com/notes.obj",
+      "Other": "gopher://example.com/nope",
+      "ContainedObjects": [
+        {"CustomImage": {"ImageURL": "http://example.com/a\\b.png", "ImageSecondaryURL": "relative.png", "WidthScale": 0.0}}
+      ]
+    }
+  ]
+}'''
+
+class StreamUrlsTest(unittest.TestCase):
+  def stream(self,text,chunk_size):
+    chunks=[text[n:n+chunk_size] for n in range(0,len(text),chunk_size)]
+    return set(tts.jsonstream.iter_stream_urls(chunks))
+
+  def test_matches_iter_save_urls(self):
+    expected=tts.save.get_save_urls(json.loads(SAVE))
+    self.assertIn('http://example.com/mesh.obj',expected)
+    self.assertIn('http://example.com/café.png',expected)
+    self.assertNotIn('http://example.com/page',expected)
+    self.assertNotIn('http://example.com/in-a-list',expected)
+    # Every chunk boundary, including those inside strings and escapes.
+    for chunk_size in (1,2,3,7,64,len(SAVE)):
+      self.assertEqual(self.stream(SAVE,chunk_size),expected)
+
+  def test_generated_save(self):
+    data={'SaveName':'x','ObjectStates':[
+      {'GUID':n,'LuaScript':'http://example.com/%d' % n,'AssetbundleURL':'http://example.com/☃/%d\n' % n,
+       'Rules':'http://example.com/rules%d' % n,'Nested':[[{'FaceURL':'http://example.com/face%d' % n}]],'Flag':False,'Extra':None}
+      for n in range(50)]}
+    for ensure_ascii in (True,False):
+      text=json.dumps(data,ensure_ascii=ensure_ascii)
+      self.assertEqual(self.stream(text,5),tts.save.get_save_urls(data))
+
+  def test_invalid_json(self):
+    with self.assertRaises(ValueError):
+      self.stream('{"SaveName": "x"} "trailing',4)
+
+class StreamFileTest(unittest.TestCase):
+  def setUp(self):
+    self.directory=tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def write(self,data):
+    filename=os.path.join(self.directory,'save.json')
+    with open(filename,'wb') as fh:
+      fh.write(data)
+    return filename
+
+  def test_encodings(self):
+    expected=tts.save.get_save_urls(json.loads(SAVE))
+    for data in (SAVE.encode('utf-8'),codecs.BOM_UTF8+SAVE.encode('utf-8'),
+                 SAVE.encode('utf-16'),codecs.BOM_UTF16_BE+SAVE.encode('utf-16-be'),SAVE.encode('utf-32')):
+      self.assertEqual(tts.jsonstream.stream_save_urls(self.write(data)),expected)
+
+  def test_scan_file_streams_large_saves(self):
+    filename=self.write(codecs.BOM_UTF8+SAVE.encode('utf-8'))
+    expected=tts.save.get_save_urls(json.loads(SAVE))
+    self.assertEqual(tts.scan.scan_file(filename),('Streamed "save"',expected))
+    with unittest.mock.patch('tts.save.STREAM_THRESHOLD',1),\
+         unittest.mock.patch('tts.load_json_file',side_effect=AssertionError("loaded")):
+      self.assertEqual(tts.scan.scan_file(filename),('Streamed "save"',expected))
+
+if __name__=='__main__':
+  unittest.main()
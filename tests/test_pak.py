@@ -0,0 +1,190 @@
+import os
+import json
+import zlib
+import random
+import hashlib
+import zipfile
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+import tts
+
+class PakTest(unittest.TestCase):
+  def setUp(self):
+    self.directory=tempfile.mkdtemp()
+    rng=random.Random(1)
+    source=os.path.join(self.directory,'source')
+    os.makedirs(source)
+    self.entries=[]
+    for n in range(4):
+      filename=os.path.join(source,'model%d.obj' % n)
+      with open(filename,'w') as fh:
+        for _ in range(5000):
+          fh.write("v %.6f %.6f %.6f\n" % (rng.random(),rng.random(),rng.random()))
+      self.entries.append((filename,'Mods/Models/model%d.obj' % n))
+    duplicate=os.path.join(source,'copy.obj')
+    shutil.copyfile(self.entries[0][0],duplicate)
+    self.entries.append((duplicate,'Mods/Models/copy.obj'))
+    filename=os.path.join(source,'save.json')
+    with open(filename,'w') as fh:
+      json.dump({'SaveName':'Test','ObjectStates':[]},fh)
+    self.entries.append((filename,'Mods/Workshop/123.json'))
+    self.library=os.path.join(self.directory,'library')
+    self.filesystem=tts.filesystem.FileSystem(base_path=self.library)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def write_pak(self,compression='deflate',level=None,jobs=None):
+    pak=os.path.join(self.directory,'%s.pak' % compression)
+    self.stats=tts.pak.write_pak(pak,self.entries,{'Id':'123','Type':'workshop'},compression=compression,level=level,jobs=jobs)
+    return pak
+
+  def corrupt(self,pak,arcname):
+    """Flip bytes in the middle of arcname's stored data."""
+    with zipfile.ZipFile(pak) as zf:
+      info=zf.getinfo(arcname)
+    with open(pak,'r+b') as fh:
+      fh.seek(info.header_offset+26)
+      name_length,extra_length=[int.from_bytes(fh.read(2),'little') for _ in range(2)]
+      fh.seek(info.header_offset+30+name_length+extra_length+info.compress_size//2)
+      data=fh.read(64)
+      fh.seek(-len(data),os.SEEK_CUR)
+      fh.write(bytes(b^0xFF for b in data))
+
+  def assertRolledBack(self,jobs):
+    """Check a corrupt pak installs nothing over an older import."""
+    old=os.path.join(self.directory,'old.obj')
+    with open(old,'w') as fh:
+      fh.write("v 0 0 0\n")
+    entries=self.entries
+    self.entries=[(old,arcname) for _,arcname in entries]
+    self.assertTrue(tts.save.importPak(self.filesystem,self.write_pak('store')))
+    self.entries=entries
+    before=self.installed()
+    for compression in tts.pak.COMPRESSION_METHODS:
+      pak=self.write_pak(compression)
+      self.corrupt(pak,'Mods/Models/model2.obj')
+      self.assertFalse(tts.save.importPak(self.filesystem,pak,jobs=jobs))
+      self.assertEqual(self.installed(),before)
+      for _,arcname in entries:
+        with open(os.path.join(self.library,arcname)) as fh:
+          self.assertEqual(fh.read(),"v 0 0 0\n")
+
+  def installed(self):
+    found={}
+    for root,dirs,files in os.walk(self.library):
+      for name in files:
+        filename=os.path.join(root,name)
+        found[os.path.relpath(filename,self.library)]=os.stat(filename).st_mtime_ns
+    return found
+
+  def assertInstalled(self):
+    for filename,arcname in self.entries:
+      with open(filename,'rb') as expected,open(os.path.join(self.library,arcname),'rb') as fh:
+        self.assertEqual(fh.read(),expected.read())
+
+  def test_import(self):
+    for compression in tts.pak.COMPRESSION_METHODS:
+      for jobs in (1,4):
+        shutil.rmtree(self.library,ignore_errors=True)
+        self.assertTrue(tts.save.importPak(self.filesystem,self.write_pak(compression,jobs=jobs)))
+        self.assertInstalled()
+
+  def test_lzma_level(self):
+    sizes=[]
+    for level in (0,9):
+      self.write_pak('lzma',level)
+      sizes.append(self.stats.size)
+    self.assertLess(sizes[1],sizes[0])
+
+  def test_without_raw_writes(self):
+    with unittest.mock.patch('tts.pak.RAW_WRITES',False):
+      with self.assertLogs(tts.logger(),'WARNING'):
+        pak=self.write_pak('lzma',9)
+    self.assertTrue(tts.save.importPak(self.filesystem,pak))
+    self.assertInstalled()
+
+  def test_duplicates_are_stored_once(self):
+    pak=self.write_pak()
+    self.assertEqual((self.stats.files,self.stats.duplicates),(6,1))
+    self.assertEqual(self.stats.duplicate_size,os.path.getsize(self.entries[0][0]))
+    with zipfile.ZipFile(pak) as zf:
+      self.assertEqual(json.loads(zf.comment)['Ver'],tts.pak.ALIAS_VERSION)
+      self.assertNotIn('Mods/Models/copy.obj',zf.namelist())
+      self.assertEqual(tts.pak.read_aliases(zf,json.loads(zf.comment)),{'Mods/Models/copy.obj':'Mods/Models/model0.obj'})
+
+  def test_without_duplicates(self):
+    del self.entries[4]
+    pak=self.write_pak()
+    self.assertEqual(self.stats.duplicates,0)
+    with zipfile.ZipFile(pak) as zf:
+      self.assertEqual(json.loads(zf.comment)['Ver'],tts.pak.PAK_VERSION)
+      self.assertNotIn(tts.pak.MANIFEST_NAME,zf.namelist())
+
+  def test_compress_file_hashes_every_block(self):
+    filename=os.path.join(self.directory,'large.obj')
+    data=os.urandom(tts.pak.COPY_BUFFER)+b'v 0 0 0\n'*tts.pak.COPY_BUFFER
+    with open(filename,'wb') as fh:
+      fh.write(data)
+    for compress_type in (zipfile.ZIP_STORED,zipfile.ZIP_DEFLATED,zipfile.ZIP_LZMA):
+      compress_type,spool,crc,size,digest=tts.pak.compress_file(filename,compress_type,1)
+      if spool:
+        spool.close()
+      self.assertEqual((crc,size,digest),(zlib.crc32(data),len(data),hashlib.sha1(data).hexdigest()))
+
+  def test_corrupt_member_rolls_back(self):
+    self.assertRolledBack(1)
+
+  def test_corrupt_member_rolls_back_in_parallel(self):
+    self.assertRolledBack(4)
+
+  def test_shard(self):
+    sizes={'a':(50,0),'b':(40,0),'c':(30,0),'d':(20,0),'e':(10,0),'f':(0,0)}
+    members=[(name,'/'+name) for name in sizes]
+    shards=tts.pak.shard(members,sizes,3)
+    self.assertEqual(sorted(member for shard in shards for member in shard),members)
+    self.assertEqual(sorted(sum(sizes[name][0] for name,_ in shard) for shard in shards),[50,50,50])
+    self.assertEqual(len(tts.pak.shard(members[:2],sizes,8)),2)
+    self.assertEqual(tts.pak.shard([],sizes,4),[[]])
+
+  def test_incremental_import(self):
+    pak=self.write_pak()
+    plan=tts.save.planPak(self.filesystem,pak)
+    self.assertEqual(len(plan.new),5)
+    self.assertEqual([destination for _,destination in plan.links],[os.path.join(self.library,'Mods','Models','copy.obj')])
+    self.assertTrue(tts.save.importPak(self.filesystem,pak))
+    self.assertInstalled()
+
+    plan=tts.save.planPak(self.filesystem,pak)
+    self.assertEqual((plan.new,plan.changed,plan.links),([],[],[]))
+    self.assertEqual(len(plan.unchanged),6)
+    self.assertTrue(str(plan).startswith("0 new (0.0MB), 0 changed (0.0MB), 6 unchanged"))
+
+    changed=os.path.join(self.library,'Mods','Models','model1.obj')
+    with open(changed,'a') as fh:
+      fh.write("v 0 0 0\n")
+    os.remove(os.path.join(self.library,'Mods','Models','copy.obj'))
+    plan=tts.save.planPak(self.filesystem,pak)
+    self.assertEqual([destination for _,destination in plan.changed],[changed])
+    self.assertEqual(len(plan.links),1)
+    self.assertEqual(len(plan.unchanged),4)
+    before=self.installed()
+    self.assertTrue(tts.save.importPak(self.filesystem,pak,incremental=True))
+    self.assertInstalled()
+    after=self.installed()
+    rewritten=sorted(name for name in after if after[name]!=before.get(name) and name.startswith(os.path.join('Mods','Models')))
+    self.assertEqual(rewritten,[os.path.join('Mods','Models','copy.obj'),os.path.join('Mods','Models','model1.obj')])
+
+  def test_dry_run_writes_nothing(self):
+    pak=self.write_pak()
+    self.assertTrue(tts.save.importPak(self.filesystem,pak))
+    os.remove(self.filesystem.get_checksums_path())
+    before=self.installed()
+    filesystem=tts.filesystem.FileSystem(base_path=self.library)
+    self.assertEqual(len(tts.save.planPak(filesystem,pak).unchanged),6)
+    self.assertEqual(self.installed(),before)
+
+if __name__=='__main__':
+  unittest.main()
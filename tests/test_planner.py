@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+import unittest
+import tts
+from .localserver import LocalServer
+
+class DownloadPlanTest(unittest.TestCase):
+  def setUp(self):
+    self.directory=tempfile.mkdtemp()
+    self.filesystem=tts.filesystem.FileSystem(base_path=self.directory)
+    self.filesystem.create_dirs()
+    self.pool=tts.connection.ConnectionPool()
+    self.server=LocalServer({'/a':b'v 0 0 0\n','/b':b'v 1 1 1\n'}).__enter__()
+
+  def tearDown(self):
+    self.pool.close()
+    self.server.__exit__()
+    shutil.rmtree(self.directory)
+
+  def save(self,ident,urls):
+    data={'SaveName':'Mod %s' % ident,'ObjectStates':[{'CustomMesh':{'MeshURL':url}} for url in urls]}
+    return tts.Save(data,self.filesystem.get_workshop_path('%s.json' % ident),ident,self.filesystem)
+
+  def downloader(self):
+    dead_urls=tts.deadurls.DeadUrls(os.path.join(self.directory,'dead.json'))
+    return tts.download.Downloader(pool=self.pool,dead_urls=dead_urls,retries=0)
+
+  def test_shared_assets_are_downloaded_once(self):
+    plan=tts.DownloadPlan(self.filesystem)
+    plan.add(self.save('1',[self.server.url('/a'),self.server.url('/b')]))
+    # Strips to the same cache name as /a.
+    plan.add(self.save('2',[self.server.url('/a?'),self.server.url('/missing')]))
+    self.assertEqual(plan.wanted,4)
+    self.assertEqual(len(plan),3)
+    self.assertEqual(plan.owners[tts.strip_filename(self.server.url('/a'))],['1','2'])
+
+    report=plan.run(self.downloader())
+    self.assertEqual(self.server.hits,{'/a':1,'/b':1,'/missing':1})
+    self.assertFalse(report.successful)
+    self.assertEqual([(save.ident,urls) for save,urls in report.missing],[('2',[self.server.url('/missing')])])
+    self.assertEqual(str(report).splitlines(),[
+      "2 downloaded, 0 already present, 1 failed.",
+      "1 saves still have missing files:",
+      "Mod 2 (2): 1 missing",
+      "  "+self.server.url('/missing')])
+
+  def test_only_missing_assets_are_planned(self):
+    self.assertTrue(tts.Url(self.server.url('/a'),self.filesystem).download(self.pool))
+    plan=tts.DownloadPlan(self.filesystem)
+    plan.add(self.save('1',[self.server.url('/a'),self.server.url('/b')]))
+    self.assertEqual(list(plan.assets),[tts.strip_filename(self.server.url('/b'))])
+    report=plan.run(self.downloader())
+    self.assertTrue(report.successful)
+    self.assertEqual(str(report),"1 downloaded, 0 already present, 0 failed.")
+
+    plan=tts.DownloadPlan(self.filesystem,refresh=True)
+    plan.add(self.save('1',[self.server.url('/a'),self.server.url('/b')]))
+    self.assertEqual(len(plan),2)
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,106 @@
+import os
+import json
+import codecs
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+import tts
+
+SAVE={'SaveName':'Café ☃','ObjectStates':[{'Nickname':'naïve','Value':1.5,'Flags':[True,None]}]}
+
+class LoadJsonTest(unittest.TestCase):
+  def setUp(self):
+    self.directory=tempfile.mkdtemp()
+    self.filename=os.path.join(self.directory,'save.json')
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def load(self,data):
+    with open(self.filename,'wb') as fh:
+      fh.write(data)
+    return tts.load_json_file(self.filename)
+
+  def encodings(self):
+    text=json.dumps(SAVE,ensure_ascii=False)
+    yield 'utf-8',text.encode('utf-8')
+    yield 'utf-8-sig',codecs.BOM_UTF8+text.encode('utf-8')
+    yield 'utf-16',codecs.BOM_UTF16_LE+text.encode('utf-16-le')
+    yield 'utf-16',codecs.BOM_UTF16_BE+text.encode('utf-16-be')
+    yield 'utf-32',text.encode('utf-32')
+
+  def test_sniff_encodings(self):
+    for encoding,data in self.encodings():
+      if encoding!='utf-8':
+        self.assertEqual(tts.sniff_encodings(data[:4]),[encoding])
+    self.assertEqual(tts.sniff_encodings(b'{"Sa'),tts.tts.JSON_ENCODINGS)
+
+  def test_encodings(self):
+    for orjson in (tts.tts.orjson,None):
+      with unittest.mock.patch('tts.tts.orjson',orjson):
+        for encoding,data in self.encodings():
+          self.assertEqual(self.load(data),SAVE,encoding)
+          self.assertEqual(tts.json_load_info[self.filename].encoding,encoding)
+
+  def test_legacy_encoding(self):
+    # Not valid utf-8, so it is read as windows-1250, the next encoding tried.
+    self.assertEqual(self.load(b'{"SaveName": "Caf\xe9"}'),{'SaveName':'Caf\u00e9'})
+    self.assertEqual(tts.json_load_info[self.filename].encoding,'windows-1250')
+
+  def test_mapped(self):
+    with unittest.mock.patch('tts.tts.MMAP_THRESHOLD',1):
+      for encoding,data in self.encodings():
+        self.assertEqual(self.load(data),SAVE,encoding)
+        self.assertTrue(tts.json_load_info[self.filename].mapped)
+
+  def test_unreadable(self):
+    self.assertIsNone(self.load(b''))
+    self.assertIsNone(tts.load_json_file(os.path.join(self.directory,'missing.json')))
+    with self.assertRaises(ValueError):
+      self.load(b'{"SaveName": ')
+
+class SaveNameTest(unittest.TestCase):
+  def setUp(self):
+    self.directory=tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def write(self,data,name='save.json'):
+    filename=os.path.join(self.directory,name)
+    with open(filename,'wb') as fh:
+      fh.write(data.encode('utf-8') if isinstance(data,str) else data)
+    return filename
+
+  def test_scan_save_name(self):
+    self.assertEqual(tts.scan_save_name('{"SaveName": "First", "ObjectStates": []}'),"First")
+    self.assertEqual(tts.scan_save_name(' {\n "Date" : "x", "Note": {"SaveName": "nested"},\n "Tags": ["SaveName"], "SaveName":"Later"'),"Later")
+    self.assertEqual(tts.scan_save_name(r'{"SaveName": "Tab\t\"quoted\" é"'),'Tab\t"quoted" é')
+    self.assertEqual(tts.scan_save_name('{"Save\\u004eame": 12}'),12)
+
+  def test_scan_save_name_not_found(self):
+    for text in ['','[]','{}','{"Other": 1}','{"Other": "trunc','{"Other": 1 "SaveName": "x"}','{"SaveName": "trunc']:
+      self.assertIsNone(tts.scan_save_name(text),text)
+
+  def test_read_save_name(self):
+    filename=self.write('{"SaveName": "Quick", "ObjectStates": []}')
+    self.assertEqual(tts.read_save_name(filename),"Quick")
+    # Found by loading the whole file when it is too far in to scan for.
+    filename=self.write(json.dumps({'Padding':'x'*(tts.tts.SAVE_NAME_PREFIX*2),'SaveName':'Slow'}))
+    self.assertEqual(tts.read_save_name(filename),"Slow")
+    filename=self.write('{"SaveName": "Renamed", "ObjectStates": []}')
+    self.assertEqual(tts.read_save_name(filename),"Renamed")
+
+  def test_read_save_name_errors(self):
+    with self.assertRaises(KeyError):
+      tts.read_save_name(self.write('{"ObjectStates": []}'))
+    for data in [b'',b'not json',b'\xff\xfe\x00']:
+      with self.assertRaises(ValueError):
+        tts.read_save_name(self.write(data))
+    filesystem=tts.filesystem.FileSystem(base_path=self.directory)
+    filename=self.write(json.dumps({'Padding':'x'*(tts.tts.SAVE_NAME_PREFIX*2)})[:-10])
+    self.assertIsNone(tts.Save.from_file(filename,'123',filesystem))
+
+if __name__=='__main__':
+  unittest.main()
@@ -1,6 +1,15 @@
 from .url import Url
-from .save import Save
+from . import connection
+from . import store
+from . import deadurls
+from . import pak
+from .save import Save,SaveSummary
+from .download import Downloader,DownloadResults,DownloadStatus
+from .planner import DownloadPlan,PlanReport
 from .tts import *
 from .filesystem import *
 from .logger import *
 from .preferences import Preferences
+from .catalog import Catalog
+from . import scan
+from . import jsonstream
@@ -0,0 +1,171 @@
+import os
+import json
+import sqlite3
+import threading
+import tts
+from .filesystem import IMAGE_FORMATS,MODEL_FORMATS,standard_cachepath
+
+SCHEMA_VERSION=2
+
+def default_catalog_filename():
+  return os.path.join(standard_cachepath(),'tts_manager_catalog.sqlite')
+
+def file_signature(filename):
+  """(mtime,size) of filename, used to tell whether a catalog entry is stale."""
+  stat=os.stat(filename)
+  return stat.st_mtime_ns,stat.st_size
+
+class Catalog:
+  """A persistent record of the saves and cached assets of a FileSystem.
+
+  Saves are keyed by path and only re-read when their mtime or size has
+  changed, so listing a library doesn't need to parse every save file.
+  """
+  def __init__(self,filesystem,filename=None):
+    self.filesystem=filesystem
+    if filename is None:
+      filename=default_catalog_filename()
+    self.filename=filename
+    os.makedirs(os.path.dirname(filename),exist_ok=True)
+    self._lock=threading.Lock()
+    self._db=sqlite3.connect(filename,check_same_thread=False)
+    self._create()
+
+  def _create(self):
+    with self._lock,self._db:
+      version=self._db.execute("PRAGMA user_version").fetchone()[0]
+      if version!=SCHEMA_VERSION:
+        tts.logger().info("Creating catalog %s" % self.filename)
+        self._db.execute("DROP TABLE IF EXISTS saves")
+        self._db.execute("DROP TABLE IF EXISTS assets")
+        self._db.execute("DROP TABLE IF EXISTS directories")
+      self._db.execute("""CREATE TABLE IF NOT EXISTS saves (
+        path TEXT PRIMARY KEY, directory TEXT, ident TEXT, type INTEGER,
+        name TEXT, mtime INTEGER, size INTEGER, urls TEXT)""")
+      self._db.execute("""CREATE TABLE IF NOT EXISTS assets (
+        path TEXT PRIMARY KEY, directory TEXT, name TEXT, kind TEXT,
+        mtime INTEGER, size INTEGER)""")
+      self._db.execute("CREATE INDEX IF NOT EXISTS assets_name ON assets(name)")
+      self._db.execute("""CREATE TABLE IF NOT EXISTS directories (
+        path TEXT PRIMARY KEY, mtime INTEGER)""")
+      self._db.execute("PRAGMA user_version=%d" % SCHEMA_VERSION)
+
+  def close(self):
+    self._db.close()
+
+  def _lookup_save(self,filename):
+    """Return (signature,(name,urls)) for a save; the record is None if the
+    catalog entry is missing or stale."""
+    signature=file_signature(filename)
+    with self._lock:
+      row=self._db.execute("SELECT mtime,size,name,urls FROM saves WHERE path=?",(filename,)).fetchone()
+    if row and (row[0],row[1])==signature:
+      return signature,(row[2],json.loads(row[3]))
+    tts.logger().debug("Catalog entry for %s is stale." % filename)
+    return signature,None
+
+  def _store_save(self,filename,ident,save_type,signature,name,urls):
+    urls=sorted(urls)
+    with self._lock,self._db:
+      self._db.execute("INSERT OR REPLACE INTO saves VALUES (?,?,?,?,?,?,?,?)",
+                       (filename,os.path.dirname(filename),ident,int(save_type),name,
+                        signature[0],signature[1],json.dumps(urls)))
+    return name,urls
+
+  def _save_record(self,filename,ident,save_type):
+    """Return (name,urls) for a save, re-reading it only if it has changed."""
+    signature,record=self._lookup_save(filename)
+    if record:
+      return record
+    record=tts.scan.scan_file(filename)
+    if not record:
+      return None
+    return self._store_save(filename,ident,save_type,signature,*record)
+
+  def refresh_saves(self,save_type,jobs=1):
+    """Bring the catalog up to date for every save of save_type, re-reading
+    changed saves on `jobs` processes.
+
+    Returns a dict of ident to (filename,name,urls)."""
+    result={}
+    stale={}
+    directory=self.filesystem.get_dir_by_type(save_type)
+    for ident in self.filesystem.get_filenames_by_type(save_type):
+      filename=self.filesystem.get_json_filename_for_type(ident,save_type)
+      if not filename:
+        continue
+      signature,record=self._lookup_save(filename)
+      if record:
+        result[ident]=(filename,)+record
+      else:
+        stale[filename]=(ident,signature)
+    for filename,record in tts.scan.scan_files(stale,jobs):
+      if not record:
+        tts.logger().error("Unable to read data file %s" % filename)
+        continue
+      ident,signature=stale[filename]
+      result[ident]=(filename,)+self._store_save(filename,ident,save_type,signature,*record)
+    found=set(filename for filename,_,_ in result.values())
+    with self._lock,self._db:
+      rows=self._db.execute("SELECT path FROM saves WHERE directory=?",(directory,)).fetchall()
+      self._db.executemany("DELETE FROM saves WHERE path=?",[row for row in rows if row[0] not in found])
+    return result
+
+  def describe(self,save_type,jobs=1):
+    """List of (name,id) for every save of save_type."""
+    return [(name,ident) for ident,(_,name,_) in self.refresh_saves(save_type,jobs).items()]
+
+  def load_save(self,ident,save_type):
+    """Build a Save for ident from the catalog, without keeping its json."""
+    filename=self.filesystem.get_json_filename_for_type(ident,save_type)
+    if not filename:
+      return None
+    record=self._save_record(filename,ident,save_type)
+    if not record:
+      return None
+    name,urls=record
+    return tts.Save(savedata=None,
+                    filename=filename,
+                    ident=ident,
+                    save_type=save_type,
+                    filesystem=self.filesystem,
+                    save_name=name,
+                    urls=urls)
+
+  def refresh_assets(self):
+    """Bring the catalog up to date with the image and model directories."""
+    formats=[(self.filesystem.get_image_path(''),IMAGE_FORMATS),
+             (self.filesystem.get_model_path(''),MODEL_FORMATS)]
+    for directory,extensions in formats:
+      directory=os.path.normpath(directory)
+      try:
+        mtime=os.stat(directory).st_mtime_ns
+      except OSError:
+        continue
+      with self._lock:
+        row=self._db.execute("SELECT mtime FROM directories WHERE path=?",(directory,)).fetchone()
+        if row and row[0]==mtime:
+          continue
+        known=dict((path,(mtime,size)) for path,mtime,size in
+                   self._db.execute("SELECT path,mtime,size FROM assets WHERE directory=?",(directory,)))
+      changed=[]
+      with os.scandir(directory) as entries:
+        for entry in entries:
+          name,ext=os.path.splitext(entry.name)
+          if ext not in extensions or not entry.is_file():
+            continue
+          stat=entry.stat()
+          signature=(stat.st_mtime_ns,stat.st_size)
+          if known.pop(entry.path,None)!=signature:
+            changed.append((entry.path,directory,name,ext[1:],signature[0],signature[1]))
+      tts.logger().debug("Catalog: {} assets changed, {} removed in {}".format(len(changed),len(known),directory))
+      with self._lock,self._db:
+        self._db.executemany("INSERT OR REPLACE INTO assets VALUES (?,?,?,?,?,?)",changed)
+        self._db.executemany("DELETE FROM assets WHERE path=?",[(path,) for path in known])
+        self._db.execute("INSERT OR REPLACE INTO directories VALUES (?,?)",(directory,mtime))
+
+  def asset_size(self,name):
+    """Size of the cached asset with the given stripped name, or None."""
+    with self._lock:
+      row=self._db.execute("SELECT size FROM assets WHERE name=?",(name,)).fetchone()
+    return row[0] if row else None
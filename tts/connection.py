@@ -0,0 +1,196 @@
+import http.client
+import ssl
+import threading
+import collections
+import urllib.parse
+import urllib.request
+import urllib.error
+import tts
+
+USER_AGENT='Mozilla/4.0 (compatible; MSIE 5.5; Windows NT)'
+MAX_REDIRECTS=5
+# Connections kept open per host between requests.
+MAX_IDLE_PER_HOST=8
+# Error bodies smaller than this are read so the connection can be reused.
+MAX_DRAIN=64*1024
+# Seconds to wait for a connection to be made, and then for each read.
+DEFAULT_CONNECT_TIMEOUT=15
+DEFAULT_READ_TIMEOUT=30
+
+class PooledResponse:
+  """An http.client.HTTPResponse which hands its connection back to the pool
+  once the body has been read and the response closed."""
+  def __init__(self,pool,key,conn,response,url):
+    self._pool=pool
+    self._key=key
+    self._conn=conn
+    self._response=response
+    self.url=url
+    self.status=response.status
+    self.reason=response.reason
+    self.headers=response.headers
+
+  def read(self,amt=None):
+    return self._response.read(amt)
+
+  def getheader(self,name,default=None):
+    return self._response.getheader(name,default)
+
+  def geturl(self):
+    return self.url
+
+  def close(self):
+    if self._conn is None:
+      return
+    # The response closes itself once the whole body has been read.
+    reusable=self._response.isclosed() and not self._response.will_close
+    self._response.close()
+    if reusable:
+      self._pool._release(self._key,self._conn)
+    else:
+      self._conn.close()
+    self._conn=None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self,*args):
+    self.close()
+
+class ConnectionPool:
+  """Keeps persistent HTTP(S) connections open per host so that downloads
+  from the same host don't each pay for a new TCP/TLS handshake.
+
+  A connection attempt gives up after connect_timeout seconds, and a
+  request after read_timeout seconds without receiving anything."""
+  def __init__(self,max_idle_per_host=MAX_IDLE_PER_HOST,
+               connect_timeout=DEFAULT_CONNECT_TIMEOUT,read_timeout=DEFAULT_READ_TIMEOUT):
+    self.max_idle_per_host=max_idle_per_host
+    self.connect_timeout=connect_timeout
+    self.read_timeout=read_timeout
+    self._idle=collections.defaultdict(list)
+    self._lock=threading.Lock()
+    self._ssl_context=None
+    self.stats=collections.Counter()
+
+  def _count(self,stat):
+    with self._lock:
+      self.stats[stat]+=1
+
+  def _acquire(self,key):
+    with self._lock:
+      if self._idle[key]:
+        return self._idle[key].pop(),True
+    scheme,host,port=key
+    if scheme=='https':
+      if self._ssl_context is None:
+        self._ssl_context=ssl.create_default_context()
+      conn=http.client.HTTPSConnection(host,port,timeout=self.connect_timeout,context=self._ssl_context)
+    else:
+      conn=http.client.HTTPConnection(host,port,timeout=self.connect_timeout)
+    self._count('opened')
+    return conn,False
+
+  def _release(self,key,conn):
+    with self._lock:
+      if len(self._idle[key])<self.max_idle_per_host:
+        self._idle[key].append(conn)
+        return
+    conn.close()
+
+  def close(self):
+    """Close all idle connections."""
+    with self._lock:
+      idle=self._idle
+      self._idle=collections.defaultdict(list)
+    for conns in idle.values():
+      for conn in conns:
+        conn.close()
+
+  def describe_stats(self):
+    return "{} requests, {} connections opened, {} reused.".format(
+      self.stats['requests'],self.stats['opened'],self.stats['reused'])
+
+  def _request(self,key,path,headers,method='GET'):
+    conn,reused=self._acquire(key)
+    try:
+      if conn.sock is None:
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+      conn.request(method,path,headers=headers)
+      response=conn.getresponse()
+    except (http.client.RemoteDisconnected,ConnectionResetError,BrokenPipeError):
+      conn.close()
+      if not reused:
+        raise
+      # The server dropped an idle connection; try again on a fresh one.
+      return self._request(key,path,headers,method)
+    except Exception:
+      conn.close()
+      raise
+    if reused:
+      self._count('reused')
+    return conn,response
+
+  def open(self,url,headers=None,method='GET'):
+    """GET (or HEAD) url, following redirects.
+
+    Returns a file-like response; raises urllib.error.HTTPError for error
+    statuses, as urllib.request.urlopen does."""
+    request_headers={ 'User-Agent' : USER_AGENT }
+    if headers:
+      request_headers.update(headers)
+    for _ in range(MAX_REDIRECTS+1):
+      parts=urllib.parse.urlsplit(url)
+      if parts.scheme not in ('http','https') or urllib.request.getproxies().get(parts.scheme):
+        # Let urllib deal with anything we don't pool (proxies, ftp).
+        return urllib.request.urlopen(urllib.request.Request(url,headers=request_headers,method=method),
+                                      timeout=max(self.connect_timeout,self.read_timeout))
+      port=parts.port or (443 if parts.scheme=='https' else 80)
+      key=(parts.scheme,parts.hostname,port)
+      path=parts.path or '/'
+      if parts.query:
+        path+='?'+parts.query
+      self._count('requests')
+      conn,response=self._request(key,path,request_headers,method)
+      pooled=PooledResponse(self,key,conn,response,url)
+      if response.status in (301,302,303,307,308) and response.getheader('Location'):
+        self._discard_body(pooled)
+        url=urllib.parse.urljoin(url,response.getheader('Location'))
+        tts.logger().debug("Redirected to %s" % url)
+        continue
+      if response.status>=400:
+        self._discard_body(pooled)
+        raise urllib.error.HTTPError(url,response.status,response.reason,response.headers,None)
+      return pooled
+    raise urllib.error.URLError("Too many redirects for %s" % url)
+
+  def content_length(self,url):
+    """The size of url according to a HEAD request, or None if unknown."""
+    if len(url.split('://'))==1:
+      url="http://"+url
+    try:
+      with self.open(url,method='HEAD') as response:
+        response.read()
+        length=response.headers.get('Content-Length')
+    except (urllib.error.URLError,http.client.HTTPException,OSError) as e:
+      tts.logger().debug("Unable to find size of %s (%s)" % (url,e))
+      return None
+    if length and length.isdigit():
+      return int(length)
+    return None
+
+  def _discard_body(self,response):
+    length=response.getheader('Content-Length')
+    if length and length.isdigit() and int(length)<=MAX_DRAIN:
+      try:
+        response.read()
+      except (http.client.HTTPException,OSError):
+        pass
+    response.close()
+
+_default_pool=ConnectionPool()
+
+def default_pool():
+  """The pool shared by all downloads which aren't given one explicitly."""
+  return _default_pool
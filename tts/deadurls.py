@@ -0,0 +1,71 @@
+import os
+import time
+import threading
+import tts
+from .filesystem import standard_cachepath
+from .store import JsonStore
+
+# Failures which usually mean the asset is gone for good.
+PERMANENT_FAILURES=frozenset(['http 404','http 410','dns'])
+# Delay before the first retry, doubled after each further failure.
+PERMANENT_DELAY=24*60*60
+TRANSIENT_DELAY=60*60
+MAX_DELAY=90*24*60*60
+
+_default_cache=None
+_default_lock=threading.Lock()
+
+def default_dead_urls_filename():
+  return os.path.join(standard_cachepath(),'tts_manager_dead_urls.json')
+
+def default_cache():
+  """The DeadUrls shared by downloads which don't supply their own."""
+  global _default_cache
+  with _default_lock:
+    if _default_cache is None:
+      _default_cache=DeadUrls()
+    return _default_cache
+
+def retry_delay(failure,attempts):
+  """Seconds to wait before trying an url again after `attempts` failures."""
+  base=PERMANENT_DELAY if failure in PERMANENT_FAILURES else TRANSIENT_DELAY
+  return min(MAX_DELAY,base*2**(max(1,attempts)-1))
+
+class DeadUrls:
+  """A persistent record of urls which failed to download.
+
+  Each url keeps the class of its last failure (e.g. 'http 404', 'dns',
+  'timeout'), when it happened and how many times in a row it has failed.
+  It is considered dead until retry_delay has passed.
+  """
+  def __init__(self,filename=None):
+    if filename is None:
+      filename=default_dead_urls_filename()
+    self.store=JsonStore(filename)
+
+  def record_failure(self,url,failure,now=None):
+    if now is None:
+      now=time.time()
+    entry=self.store.get(url) or {}
+    attempts=entry.get('attempts',0)+1
+    self.store.set(url,{'failure':failure,'time':now,'attempts':attempts})
+    tts.logger().debug("Marked %s dead after %d failures (%s)" % (url,attempts,failure))
+
+  def record_success(self,url):
+    self.store.pop(url)
+
+  def entry(self,url):
+    """The recorded failure of url, or None."""
+    return self.store.get(url)
+
+  def is_dead(self,url,now=None):
+    """Has url failed recently enough that it shouldn't be tried again yet?"""
+    entry=self.store.get(url)
+    if not entry:
+      return False
+    if now is None:
+      now=time.time()
+    return now<entry['time']+retry_delay(entry['failure'],entry['attempts'])
+
+  def save(self):
+    return self.store.save()
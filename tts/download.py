@@ -0,0 +1,326 @@
+import threading
+import collections
+import urllib.parse
+import heapq
+import itertools
+import random
+import time
+import os.path
+import concurrent.futures
+import tts
+from enum import IntEnum
+
+DEFAULT_WORKERS=8
+DEFAULT_PER_HOST=4
+# Further attempts at an url after a transient failure.
+DEFAULT_RETRIES=2
+# Seconds before the first retry; doubled for each one after, with jitter.
+DEFAULT_RETRY_DELAY=2.0
+# Failures in a row after which a host is given up on for the run.
+DEFAULT_BREAKER_THRESHOLD=5
+# Size assumed, when scheduling, for files of unknown size.
+UNKNOWN_SIZE=1024*1024
+
+IMAGE_EXTENSIONS=frozenset(['.png','.jpg','.jpeg','.bmp'])
+
+class DownloadStatus(IntEnum):
+  downloaded = 1
+  exists = 2
+  failed = 3
+  skipped = 4
+  unchanged = 5
+
+class DownloadResults(dict):
+  """Maps each url to the DownloadStatus of its download."""
+  def __init__(self,*args,**kwargs):
+    super().__init__(*args,**kwargs)
+    # Set when the download couldn't be attempted at all (e.g. unreadable save).
+    self.error=None
+
+  @property
+  def successful(self):
+    statuses=set(self.values())
+    return self.error is None and DownloadStatus.failed not in statuses and DownloadStatus.skipped not in statuses
+
+  @property
+  def failed(self):
+    return [url for url,status in self.items() if status==DownloadStatus.failed]
+
+  @property
+  def skipped(self):
+    return [url for url,status in self.items() if status==DownloadStatus.skipped]
+
+  def count(self,status):
+    return sum(1 for x in self.values() if x==status)
+
+  def summary(self):
+    if self.error:
+      return self.error
+    result="{} downloaded, {} already present, {} failed".format(
+      self.count(DownloadStatus.downloaded),
+      self.count(DownloadStatus.exists),
+      self.count(DownloadStatus.failed))
+    unchanged=self.count(DownloadStatus.unchanged)
+    if unchanged:
+      result+=", {} unchanged".format(unchanged)
+    skipped=self.count(DownloadStatus.skipped)
+    if skipped:
+      result+=", {} skipped as known dead (see --retry-dead)".format(skipped)
+    return result+'.'
+
+def is_transient(failure):
+  """Might a download which failed this way (see url.failure_class) work
+  if it is tried again shortly?"""
+  return failure in ('connection','timeout','protocol','http 429') or failure.startswith('http 5')
+
+class CircuitBreaker:
+  """Counts failures in a row for each host. Once a host reaches
+  threshold it is open, and no more downloads should be tried from it."""
+  def __init__(self,threshold=DEFAULT_BREAKER_THRESHOLD):
+    self.threshold=threshold
+    self.failures=collections.Counter()
+
+  def succeeded(self,host):
+    self.failures.pop(host,None)
+
+  def failed(self,host):
+    self.failures[host]+=1
+    if self.failures[host]==self.threshold:
+      tts.logger().warn("Giving up on {} after {} failures in a row.".format(host,self.threshold))
+
+  def is_open(self,host):
+    return self.threshold>0 and self.failures[host]>=self.threshold
+
+def asset_kind(url):
+  """0 for an image, 2 for a model and 1 if it isn't known yet; images
+  are downloaded first."""
+  if url.isImage is not None:
+    return 0 if url.isImage else 2
+  ext=os.path.splitext(urllib.parse.urlsplit(url.url).path)[1].lower()
+  if ext in IMAGE_EXTENSIONS:
+    return 0
+  if ext in tts.filesystem.MODEL_FORMATS:
+    return 2
+  return 1
+
+def host_of(url):
+  """Return the host part of an url, as used for per-host limits."""
+  if len(url.split('://'))==1:
+    url="http://"+url
+  return urllib.parse.urlsplit(url).netloc.lower()
+
+class Downloader:
+  """Downloads Url objects on a pool of worker threads.
+
+  At most `workers` downloads run at once, and at most `per_host` of those
+  against any single host. Connections are kept open in `pool` (by default
+  the shared pool) and reused between urls and between calls.
+
+  Downloads are started in priority order: urls of mods raised with
+  prioritise() first, then images before models, then smaller files
+  first. The catalog only knows the size of files which are already
+  cached, so it helps only when refreshing; files still to be downloaded
+  are ordered by size only if probe_sizes is set, which asks each server
+  with a HEAD request first.
+
+  Failures are recorded in `dead_urls` (by default the shared DeadUrls),
+  and urls which failed recently are skipped unless retry_dead is set.
+
+  An url which fails transiently is tried up to `retries` more times,
+  after a jittered, exponentially growing delay. A host which fails
+  `breaker_threshold` times in a row (0 for never) gets no more requests,
+  and its remaining urls fail straight away.
+
+  If refresh is set, urls which are already cached are checked with a
+  conditional request and downloaded again only if they have changed.
+  """
+  def __init__(self,workers=DEFAULT_WORKERS,per_host=DEFAULT_PER_HOST,pool=None,dead_urls=None,retry_dead=False,
+               retries=DEFAULT_RETRIES,retry_delay=DEFAULT_RETRY_DELAY,breaker_threshold=DEFAULT_BREAKER_THRESHOLD,
+               refresh=False,catalog=None,probe_sizes=False):
+    self.workers=max(1,workers)
+    self.per_host=max(1,per_host)
+    self.retries=max(0,retries)
+    self.retry_delay=retry_delay
+    self.breaker=CircuitBreaker(breaker_threshold)
+    self.refresh=refresh
+    self.catalog=catalog
+    self.probe_sizes=probe_sizes
+    if pool is None:
+      pool=tts.connection.default_pool()
+    self.pool=pool
+    if dead_urls is None:
+      dead_urls=tts.deadurls.default_cache()
+    self.dead_urls=dead_urls
+    self.retry_dead=retry_dead
+    # mod ident -> how recently it was prioritised
+    self.boosts={}
+    self._boost_sequence=itertools.count(1)
+    self._cond=threading.Condition()
+    # The queues and priority information of the download in progress.
+    self._pending=None
+    self._owners={}
+    self._sizes={}
+
+  def prioritise(self,ident):
+    """Start the downloads of mod ident ahead of all the others, including
+    those of any mod prioritised before. Takes effect immediately if a
+    download is running."""
+    tts.logger().info("Prioritising downloads for %s." % ident)
+    with self._cond:
+      self.boosts[ident]=next(self._boost_sequence)
+      if self._pending:
+        for host,queue in self._pending.items():
+          queue[:]=[(self._priority(url),seq,url) for _,seq,url in queue]
+          heapq.heapify(queue)
+
+  def _priority(self,url):
+    boost=max((self.boosts.get(ident,0) for ident in self._owners.get(url.url,())),default=0)
+    return (-boost,asset_kind(url),self._sizes.get(url.url) or UNKNOWN_SIZE)
+
+  def _find_sizes(self,urls):
+    """url -> size of each of urls whose size is known: from the catalog,
+    which has only cached files, then from HEAD requests if probe_sizes."""
+    sizes={}
+    if self.catalog:
+      for url in urls:
+        size=self.catalog.asset_size(url.stripped_url)
+        if size is not None:
+          sizes[url.url]=size
+    if self.probe_sizes:
+      probe=[url for url in urls if url.url not in sizes]
+      tts.logger().info("Asking for the size of %d files." % len(probe))
+      with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+        for url,size in zip(probe,executor.map(lambda url: self.pool.content_length(url.url),probe)):
+          if size is not None:
+            sizes[url.url]=size
+    return sizes
+
+  def download(self,urls,owners=None):
+    """Download urls, returning a DownloadResults.
+
+    owners optionally maps each url to the idents of the mods which use
+    it, for prioritise()."""
+    log=tts.logger()
+    results=DownloadResults()
+    queued=[]
+    seen=set()
+    for url in urls:
+      if url.url in seen:
+        continue
+      seen.add(url.url)
+      if not self.retry_dead and not url.exists and self.dead_urls.is_dead(url.url):
+        log.info("Skipping {}, which failed recently ({}).".format(url.url,self.dead_urls.entry(url.url)['failure']))
+        results[url.url]=DownloadStatus.skipped
+        continue
+      queued.append(url)
+    total=len(seen)
+    if not queued:
+      if results:
+        log.info(results.summary())
+      return results
+    sizes=self._find_sizes(queued)
+    cond=self._cond
+    # host -> heap of (priority,sequence,url)
+    pending=collections.OrderedDict()
+    sequence=itertools.count()
+    with cond:
+      self._owners=owners or {}
+      self._sizes=sizes
+      self._pending=pending
+      for url in queued:
+        pending.setdefault(host_of(url.url),[]).append((self._priority(url),next(sequence),url))
+      for queue in pending.values():
+        heapq.heapify(queue)
+    active=collections.Counter()
+    # (due time,sequence,host,url) of downloads waiting to be retried
+    delayed=[]
+    attempts=collections.Counter()
+
+    def finish(url,status):
+      results[url.url]=status
+      log.info("Finished {} of {}: {}".format(len(results),total,url.url))
+
+    def next_job():
+      now=time.monotonic()
+      while delayed and delayed[0][0]<=now:
+        _,_,host,url=heapq.heappop(delayed)
+        heapq.heappush(pending.setdefault(host,[]),(self._priority(url),next(sequence),url))
+      # The most urgent url of any host which still has spare capacity.
+      best=None
+      for host in list(pending):
+        if self.breaker.is_open(host):
+          for _,_,url in pending.pop(host):
+            log.error("Not downloading {}, {} is failing.".format(url.url,host))
+            finish(url,DownloadStatus.failed)
+          continue
+        if active[host]<self.per_host and (best is None or pending[host][0]<pending[best][0]):
+          best=host
+      if best is None:
+        return None,None
+      queue=pending[best]
+      url=heapq.heappop(queue)[2]
+      if not queue:
+        del pending[best]
+      else:
+        # Hosts with equally urgent work take turns.
+        pending.move_to_end(best)
+      return best,url
+
+    def worker():
+      while True:
+        with cond:
+          while True:
+            host,url=next_job()
+            if url:
+              break
+            if not pending and not delayed:
+              return
+            cond.wait(max(0,delayed[0][0]-time.monotonic()) if delayed else None)
+          active[host]+=1
+        status=DownloadStatus.failed
+        failure=None
+        try:
+          if url.exists and not self.refresh:
+            status=DownloadStatus.exists
+          elif url.download(self.pool,self.refresh):
+            status=DownloadStatus.unchanged if url.unchanged else DownloadStatus.downloaded
+            self.dead_urls.record_success(url.url)
+          else:
+            failure=url.last_error
+        except Exception as e:
+          log.error("Unexpected error downloading {} ({})".format(url.url,e))
+        with cond:
+          active[host]-=1
+          if status!=DownloadStatus.failed:
+            self.breaker.succeeded(host)
+            finish(url,status)
+          elif failure and (is_transient(failure) or failure=='dns'):
+            self.breaker.failed(host)
+            attempts[url.url]+=1
+            if is_transient(failure) and attempts[url.url]<=self.retries and not self.breaker.is_open(host):
+              delay=self.retry_delay*2**(attempts[url.url]-1)*random.uniform(0.5,1.5)
+              log.warn("Retrying {} in {:.1f}s ({}).".format(url.url,delay,failure))
+              heapq.heappush(delayed,(time.monotonic()+delay,next(sequence),host,url))
+            else:
+              self.dead_urls.record_failure(url.url,failure)
+              finish(url,status)
+          else:
+            if failure:
+              self.dead_urls.record_failure(url.url,failure)
+            finish(url,status)
+          cond.notify_all()
+
+    filesystems=set(url.filesystem for url in queued)
+    threads=[threading.Thread(target=worker,daemon=True) for _ in range(min(self.workers,len(queued)))]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    with cond:
+      self._pending=None
+    self.dead_urls.save()
+    for filesystem in filesystems:
+      filesystem.validators().save()
+    log.info(results.summary())
+    log.info("Connections: %s" % self.pool.describe_stats())
+    return results
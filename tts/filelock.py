@@ -0,0 +1,90 @@
+import os
+import errno
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+  import msvcrt
+  import time
+
+class FileLock:
+  """An exclusive lock shared between processes, held on a lock file.
+
+  The lock file is removed again on release where the platform allows.
+  """
+  def __init__(self,filename):
+    self.filename=filename
+    self._fh=None
+
+  def acquire(self):
+    """Take the lock, blocking until it is free.
+
+    Returns True if another process held it first."""
+    os.makedirs(os.path.dirname(self.filename),exist_ok=True)
+    if fcntl:
+      return self._acquire_posix()
+    return self._acquire_windows()
+
+  def _acquire_posix(self):
+    waited=False
+    while True:
+      fh=open(self.filename,'a+b')
+      try:
+        fcntl.flock(fh.fileno(),fcntl.LOCK_EX|fcntl.LOCK_NB)
+      except OSError as e:
+        if e.errno not in (errno.EAGAIN,errno.EACCES):
+          fh.close()
+          raise
+        waited=True
+        fcntl.flock(fh.fileno(),fcntl.LOCK_EX)
+      # The holder we waited for may have removed the file we locked.
+      try:
+        same=os.path.samestat(os.fstat(fh.fileno()),os.stat(self.filename))
+      except FileNotFoundError:
+        same=False
+      if same:
+        self._fh=fh
+        return waited
+      fh.close()
+
+  def _acquire_windows(self):
+    waited=False
+    fh=open(self.filename,'a+b')
+    fh.seek(0)
+    while True:
+      try:
+        msvcrt.locking(fh.fileno(),msvcrt.LK_NBLCK,1)
+        break
+      except OSError:
+        waited=True
+        time.sleep(0.1)
+    self._fh=fh
+    return waited
+
+  def release(self):
+    if self._fh is None:
+      return
+    if fcntl:
+      # Removed while still locked, so nobody can lock the old file after.
+      try:
+        os.remove(self.filename)
+      except OSError:
+        pass
+      fcntl.flock(self._fh.fileno(),fcntl.LOCK_UN)
+      self._fh.close()
+    else:
+      self._fh.seek(0)
+      msvcrt.locking(self._fh.fileno(),msvcrt.LK_UNLCK,1)
+      self._fh.close()
+      try:
+        os.remove(self.filename)
+      except OSError:
+        pass
+    self._fh=None
+
+  def __enter__(self):
+    self.acquire()
+    return self
+
+  def __exit__(self,*args):
+    self.release()
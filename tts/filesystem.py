@@ -1,10 +1,23 @@
 import os
 import os.path
 import tts
+import time
+import threading
 import platform
+import collections
 if platform.system() == 'Linux':
   import xdgappdirs
 
+# In order of preference when a name exists in more than one format.
+IMAGE_FORMATS=['.png','.jpg','.bmp']
+MODEL_FORMATS=['.obj']
+# How often (in seconds) to check whether the cache directories have changed.
+INDEX_CHECK_INTERVAL=2
+
+# Where the file for a url is in the cache; location and is_image are None
+# if it hasn't been downloaded.
+Resolution=collections.namedtuple('Resolution',['url','stripped','location','is_image'])
+
 def standard_basepath():
   if platform.system() == 'Windows':
     basepath = os.path.join(os.path.expanduser("~"),"Documents","My Games","Tabletop Simulator")
@@ -14,6 +27,16 @@ def standard_basepath():
     basepath = os.path.join(os.path.expanduser("~"),"Library","Tabletop Simulator")
   return basepath
 
+def standard_cachepath():
+  """Where TTS Manager keeps its own caches."""
+  if platform.system() == 'Windows':
+    cachepath = os.path.join(os.environ.get("LOCALAPPDATA",os.path.expanduser("~")),"TTS Manager")
+  elif platform.system() == 'Linux':
+    cachepath = xdgappdirs.user_cache_dir()
+  else:
+    cachepath = os.path.join(os.path.expanduser("~"),"Library","Caches","TTS Manager")
+  return cachepath
+
 class FileSystem:
   def __init__(self,base_path=None,tts_install_path=None):
     if base_path is not None:
@@ -30,6 +53,16 @@ class FileSystem:
     self._images= os.path.join(self._mods,"Images")
     self._models= os.path.join(self._mods,"Models")
     self._workshop = os.path.join(self._mods,"Workshop")
+    # Incomplete downloads; kept on the same volume as the cache so finished
+    # files can be moved into place atomically.
+    self._partial = os.path.join(self._mods,"Partial")
+    # Maps stripped name to (path,is_image) for everything in the cache.
+    self._index=None
+    self._index_mtimes=None
+    self._index_checked=0
+    self._index_lock=threading.Lock()
+    self._validators=None
+    self._checksums=None
 
   def get_dir_by_type(self,save_type):
     st={
@@ -70,6 +103,31 @@ class FileSystem:
   def get_model_path(self,filename):
     return os.path.join(self._models,filename)
 
+  def get_partial_path(self,filename):
+    return os.path.join(self._partial,filename)
+
+  def get_validators_path(self):
+    return os.path.join(self._mods,"tts_manager_validators.json")
+
+  def validators(self):
+    """JsonStore of the response validators (url, etag, last_modified) of
+    each cached asset, keyed by stripped name."""
+    with self._index_lock:
+      if self._validators is None:
+        self._validators=tts.store.JsonStore(self.get_validators_path())
+      return self._validators
+
+  def get_checksums_path(self):
+    return os.path.join(self._mods,"tts_manager_checksums.json")
+
+  def checksums(self):
+    """JsonStore of the (mtime,size,crc) of imported files, keyed by path,
+    so an import can tell which files it already has."""
+    with self._index_lock:
+      if self._checksums is None:
+        self._checksums=tts.store.JsonStore(self.get_checksums_path())
+      return self._checksums
+
   def get_workshop_path(self,filename):
     return os.path.join(self._workshop,filename)
 
@@ -82,34 +140,99 @@ class FileSystem:
   def get_path_by_type(self,filename,save_type):
     return os.path.join(self.get_dir_by_type(save_type),filename)
 
+  def _cache_mtimes(self):
+    mtimes=[]
+    for directory in [self._images,self._models]:
+      try:
+        mtimes.append(os.stat(directory).st_mtime_ns)
+      except OSError:
+        mtimes.append(None)
+    return mtimes
+
+  def refresh_index(self):
+    """Rebuild the index of the image and model directories."""
+    with self._index_lock:
+      mtimes=self._cache_mtimes()
+      index={}
+      ranks={}
+      formats=[(self._images,IMAGE_FORMATS,True),(self._models,MODEL_FORMATS,False)]
+      rank=0
+      for directory,extensions,is_image in formats:
+        try:
+          entries=os.scandir(directory)
+        except OSError:
+          rank+=len(extensions)
+          continue
+        with entries:
+          for entry in entries:
+            name,ext=os.path.splitext(entry.name)
+            if ext not in extensions or not entry.is_file():
+              continue
+            entry_rank=rank+extensions.index(ext)
+            if name in ranks and ranks[name]<=entry_rank:
+              continue
+            ranks[name]=entry_rank
+            index[name]=(entry.path,is_image)
+        rank+=len(extensions)
+      self._index=index
+      self._index_mtimes=mtimes
+      self._index_checked=time.monotonic()
+    tts.logger().debug("Indexed {} cache files.".format(len(index)))
+
+  def index_file(self,filename):
+    """Add a file just written to the image or model directory to the index."""
+    with self._index_lock:
+      if self._index is None:
+        return
+      name,ext=os.path.splitext(os.path.basename(filename))
+      is_image=ext in IMAGE_FORMATS
+      if not is_image and name in self._index and self._index[name][1]:
+        return
+      self._index[name]=(filename,is_image)
+
+  def _current_index(self):
+    """The index, rebuilt first if the cache directories have changed."""
+    now=time.monotonic()
+    if self._index is None or now-self._index_checked>INDEX_CHECK_INTERVAL:
+      if self._index is None or self._cache_mtimes()!=self._index_mtimes:
+        self.refresh_index()
+      else:
+        self._index_checked=now
+    return self._index
+
+  def _lookup(self,stripname):
+    return self._current_index().get(stripname,(None,None))
+
+  def resolve_many(self,urls):
+    """Look up where each of urls is in the cache.
+
+    The directories are checked once, and every url is resolved against
+    the same snapshot of the index. Returns a list of Resolution, in the
+    order of urls."""
+    index=self._current_index()
+    urls=list(urls)
+    missing=(None,None)
+    return [Resolution(url,stripped,*index.get(stripped,missing))
+            for url,stripped in zip(urls,map(tts.strip_filename,urls))]
+
   def find_details(self,basename):
-    result=self.find_image(basename)
-    if result:
-      return result,True
-    result=self.find_model(basename)
-    if result:
-      return result,False
-    return None,None
+    return self._lookup(tts.strip_filename(basename))
 
   def find_image(self,basename):
-    result=None
-    stripname = tts.strip_filename(basename)
-    for image_format in ['.png','.jpg','.bmp']:
-      filename=os.path.join(self._images,stripname+image_format)
-      if os.path.isfile(filename):
-        result=filename
-        break
-    return result
+    filename,is_image=self._lookup(tts.strip_filename(basename))
+    if is_image:
+      return filename
+    return None
 
   def find_model(self,basename):
-    result=None
     stripname = tts.strip_filename(basename)
-    for model_format in ['.obj']:
-      filename=os.path.join(self._models,stripname+model_format)
-      if os.path.isfile(filename):
-        result=filename
-        break
-    return result
+    filename,is_image=self._lookup(stripname)
+    if is_image:
+      # An image of the same name hides the model in the index.
+      filename=os.path.join(self._models,stripname+MODEL_FORMATS[0])
+      if not os.path.isfile(filename):
+        return None
+    return filename
 
   def get_filenames_in(self,search_path):
     if not os.path.isdir(search_path):
@@ -129,6 +252,14 @@ class FileSystem:
       files.remove('WorkshopFileInfos')
     return files
 
+  def get_info_filename(self,save_type):
+    """The index TTS keeps of the names of saves of save_type, if it has one."""
+    if save_type==tts.SaveType.workshop:
+      return os.path.join(self._workshop,'WorkshopFileInfos.json')
+    if save_type==tts.SaveType.save:
+      return os.path.join(self._saves,'SaveFileInfos.json')
+    return None
+
   def get_chest_filenames(self):
     return self.get_filenames_in(self._chest)
 
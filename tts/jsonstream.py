@@ -0,0 +1,121 @@
+import re
+import json
+import codecs
+import logging
+import tts
+
+# Size of the blocks a file is decoded in.
+CHUNK_SIZE=1024*1024
+
+# One json token: punctuation, a string (group 2 is its still escaped
+# contents) or a bare number/true/false/null.
+_token=re.compile(r'[ \t\n\r]*(?:([{}\[\],:])|"([^"\\]*(?:\\.[^"\\]*)*)"|([^ \t\n\r{}\[\],:"]+))',re.S)
+_trailing=re.compile(r'[ \t\n\r]*')
+
+def read_text_chunks(filename,encoding,chunk_size=CHUNK_SIZE):
+  """Yield the decoded text of filename a block at a time."""
+  decoder=codecs.getincrementaldecoder(encoding)()
+  with open(filename,'rb') as fh:
+    while True:
+      data=fh.read(chunk_size)
+      if not data:
+        break
+      yield decoder.decode(data)
+  yield decoder.decode(b'',final=True)
+
+def iter_tokens(chunks):
+  """Tokenize json text supplied as an iterable of strings.
+
+  Yields (kind,value) where kind is one of the punctuation characters
+  '{}[],:', 'string' (value is the raw, still escaped text) or 'bare'
+  (value is the text of a number, true, false or null). Only the current
+  token and the unread part of the current chunk are held in memory."""
+  chunks=iter(chunks)
+  buf=''
+  pos=0
+  eof=False
+  while True:
+    match=_token.match(buf,pos)
+    # A token touching the end of the buffer may continue in the next chunk.
+    if match is None or (match.end()==len(buf) and not eof):
+      if eof:
+        end=_trailing.match(buf,pos).end()
+        if end!=len(buf):
+          raise ValueError("Invalid json near %r" % buf[end:end+20])
+        return
+      chunk=next(chunks,None)
+      if chunk is None:
+        eof=True
+      else:
+        buf=buf[pos:]+chunk
+        pos=0
+      continue
+    pos=match.end()
+    punctuation,string,bare=match.groups()
+    if punctuation:
+      yield punctuation,None
+    elif string is not None:
+      yield 'string',string
+    else:
+      yield 'bare',bare
+
+def decode_string(raw):
+  if '\\' not in raw:
+    return raw
+  return json.decoder.scanstring(raw+'"',0)[0]
+
+def iter_stream_urls(chunks):
+  """Yield the urls in the json text of a save, supplied as an iterable of
+  strings, by the same rules as tts.save.iter_save_urls."""
+  log=tts.logger()
+  debug=log.isEnabledFor(logging.DEBUG)
+  excluded=tts.save.EXCLUDED_URL_KEYS
+  protocols=tts.save.URL_PROTOCOLS
+  containers=[]
+  expect_key=False
+  key=None
+  for kind,value in iter_tokens(chunks):
+    if kind=='string':
+      if expect_key:
+        key=decode_string(value)
+        continue
+      if not containers or containers[-1]!='{':
+        # strings in lists are never urls
+        continue
+      if key in excluded or not value:
+        continue
+      value=decode_string(value)
+      if not key.endswith('URL'):
+        protocol,separator,_=value.partition('://')
+        if not separator or protocol not in protocols:
+          continue
+      if debug:
+        log.debug("Found {}:{}".format(key,value))
+      yield value
+    elif kind=='{':
+      containers.append(kind)
+      expect_key=True
+    elif kind=='[':
+      containers.append(kind)
+      expect_key=False
+    elif kind=='}' or kind==']':
+      if not containers:
+        raise ValueError("Unbalanced %s in json" % kind)
+      containers.pop()
+      expect_key=False
+    elif kind==',':
+      expect_key=bool(containers) and containers[-1]=='{'
+    elif kind==':':
+      expect_key=False
+
+def stream_save_urls(filename):
+  """Return the set of urls in a save file without loading it into memory."""
+  log=tts.logger()
+  with open(filename,'rb') as fh:
+    encodings=tts.sniff_encodings(fh.read(4))
+  for encoding in encodings:
+    try:
+      return set(iter_stream_urls(read_text_chunks(filename,encoding)))
+    except UnicodeDecodeError:
+      log.debug("Unable to parse in encoding %s." % encoding)
+  raise ValueError("Unable to find encoding for %s." % filename)
@@ -1,4 +1,6 @@
 import logging
+import threading
+import collections
 import tkinter as Tk
 import tkinter.ttk as ttk
 import tkinter.scrolledtext as scrolledtext
@@ -44,18 +46,30 @@ class TKHandler(logging.Handler):
   def __init__(self,console=None):
     logging.Handler.__init__(self)
     self.console = console # must be a text widget of some kind.
+    # Tk may only be touched from the main thread; messages logged by worker
+    # threads are held here until the main thread logs or flushes them.
+    self.pending = collections.deque()
 
   def emit(self,message):
     formattedMessage = self.format(message)
 
     if self.console:
-      self.console.configure(state=Tk.NORMAL)
-      self.console.insert(Tk.END, formattedMessage+'\n')
-      self.console.configure(state=Tk.DISABLED)
-      self.console.see(Tk.END)
-      self.console.update()
+      self.pending.append(formattedMessage)
+      if threading.current_thread() is threading.main_thread():
+        self.flush_pending()
     print(formattedMessage)
 
+  def flush_pending(self):
+    """Show any held messages; must be called from the main thread."""
+    if not self.console or not self.pending:
+      return
+    self.console.configure(state=Tk.NORMAL)
+    while self.pending:
+      self.console.insert(Tk.END, self.pending.popleft()+'\n')
+    self.console.configure(state=Tk.DISABLED)
+    self.console.see(Tk.END)
+    self.console.update()
+
 
 _logger  = logging.getLogger("TTS Logger")
 _handler = TKHandler()
@@ -70,3 +84,29 @@ def logger():
 
 def setLoggerConsole(console):
   _handler.console=console
+
+def flushLoggerConsole():
+  _handler.flush_pending()
+
+def runInBackground(root,work,done):
+  """Run work() on a thread, showing what it logs as it goes, then call
+  done(result) on the main thread. result is None if work() failed.
+
+  Long jobs such as downloads are run this way so the window stays
+  responsive and the log keeps up."""
+  result=[None]
+  def run():
+    try:
+      result[0]=work()
+    except Exception:
+      _logger.exception("Unexpected error")
+  thread=threading.Thread(target=run,daemon=True)
+  thread.start()
+  def poll():
+    flushLoggerConsole()
+    if thread.is_alive():
+      root.after(250,poll)
+    else:
+      done(result[0])
+  root.after(250,poll)
+  return thread
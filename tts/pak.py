@@ -0,0 +1,524 @@
+import os
+import sys
+import json
+import lzma
+import hashlib
+import posixpath
+import time
+import zlib
+import heapq
+import struct
+import threading
+import shutil
+import tempfile
+import uuid
+import zipfile
+import contextlib
+import collections
+import concurrent.futures
+import tts
+
+# name -> zipfile compression type
+COMPRESSION_METHODS=collections.OrderedDict([
+  ('store',zipfile.ZIP_STORED),
+  ('deflate',zipfile.ZIP_DEFLATED),
+  ('lzma',zipfile.ZIP_LZMA)])
+# The version written unless the pak has aliases, which need ALIAS_VERSION.
+PAK_VERSION=2
+ALIAS_VERSION=3
+# Holds {"Aliases":{name:stored name}} in paks of ALIAS_VERSION.
+MANIFEST_NAME='Manifest.json'
+# Only cached assets may be aliases of one another.
+ASSET_DIRECTORIES=('Mods/Images/','Mods/Models/')
+# Suffix of the temporary files an import writes before moving them into place.
+STAGING_SUFFIX='.tts_import'
+COPY_BUFFER=1024*1024
+# Dictionary size of each lzma preset, as in liblzma.
+LZMA_DICT_SIZES=[1<<18,1<<20,1<<21,1<<22,1<<22,1<<23,1<<23,1<<24,1<<25,1<<26]
+# Memory the compressors of one pak may use between them. An lzma encoder
+# needs about 11 times its dictionary size, so high presets get fewer threads.
+COMPRESSION_MEMORY=512*1024*1024
+# General purpose flag bit 1: lzma data ends with an end-of-stream marker.
+LZMA_EOS_FLAG=0x02
+# Python versions whose ZipFile internals _write_raw() relies on. Elsewhere
+# ZipFile compresses each file itself, on one thread.
+RAW_WRITES=(3,6)<=sys.version_info[:2]<=(3,13) and hasattr(zipfile.ZipFile,'_writecheck')
+DEFAULT_COMPRESSION='deflate'
+DEFAULT_LEVEL=6
+# Formats which are compressed already; compressing them again costs time
+# and saves nothing, so they are always stored.
+PRECOMPRESSED_EXTENSIONS=frozenset(['.png','.jpg','.jpeg','.gif','.webp',
+                                    '.mp3','.ogg','.wav','.mp4','.webm',
+                                    '.unity3d','.zip','.pak'])
+
+class PakStats(collections.namedtuple('PakStats',['files','raw_size','size','seconds','duplicates','duplicate_size'])):
+  """What writing a pak took: number of files, bytes before and after
+  compression, elapsed time, and the number and size of the files which
+  were stored only once because another file had the same content."""
+  __slots__=()
+
+  def __str__(self):
+    result="{} files, {:.1f}MB packed to {:.1f}MB in {:.1f}s".format(
+      self.files,self.raw_size/1e6,self.size/1e6,self.seconds)
+    if self.duplicates:
+      result+=", {} duplicates ({:.1f}MB) stored once".format(self.duplicates,self.duplicate_size/1e6)
+    return result
+
+def is_asset(name):
+  """Is the pak member name a cached asset, which may be an alias?"""
+  return (name.startswith(ASSET_DIRECTORIES) and not posixpath.isabs(name)
+          and posixpath.normpath(name)==name)
+
+def compression_for(filename,compression=DEFAULT_COMPRESSION):
+  """The zipfile compression type to use for filename."""
+  if os.path.splitext(filename)[1].lower() in PRECOMPRESSED_EXTENSIONS:
+    return zipfile.ZIP_STORED
+  return COMPRESSION_METHODS[compression]
+
+def compression_threads(compression,level,jobs):
+  """How many of jobs threads may compress at once within COMPRESSION_MEMORY."""
+  if compression!='lzma':
+    return jobs
+  return max(1,min(jobs,COMPRESSION_MEMORY//(LZMA_DICT_SIZES[level]*11)))
+
+def _lzma_compressor(level):
+  """A raw LZMA compressor at preset level, and the header zip puts before
+  its output (APPNOTE 5.8.8). zipfile.LZMACompressor has no way to set
+  the preset, so the properties are spelt out here."""
+  dict_size=LZMA_DICT_SIZES[level]
+  compressor=lzma.LZMACompressor(lzma.FORMAT_RAW,filters=[
+    {'id':lzma.FILTER_LZMA1,'preset':level,'dict_size':dict_size,'lc':3,'lp':0,'pb':2}])
+  props=struct.pack('<BI',(2*5+0)*9+3,dict_size)
+  return compressor,struct.pack('<BBH',9,4,len(props))+props
+
+def compress_file(filename,compress_type,level=DEFAULT_LEVEL,spool=True):
+  """Read and compress filename a block at a time, hashing each block as
+  it goes. Returns (compress_type,spool,crc,size,digest), where spool is
+  a temporary file holding the compressed data.
+
+  spool is None for files which are to be stored, including those which
+  don't get smaller, and for every file if spool is False, in which case
+  filename is only hashed."""
+  header=b''
+  if not spool or compress_type==zipfile.ZIP_STORED:
+    compressor=None
+  elif compress_type==zipfile.ZIP_DEFLATED:
+    compressor=zlib.compressobj(level,zlib.DEFLATED,-15)
+  else:
+    compressor,header=_lzma_compressor(level)
+  crc=0
+  size=0
+  digest=hashlib.sha1()
+  out=tempfile.TemporaryFile() if compressor else None
+  try:
+    if out:
+      out.write(header)
+    with open(filename,'rb') as fh:
+      for block in iter(lambda: fh.read(COPY_BUFFER),b''):
+        crc=zlib.crc32(block,crc)
+        digest.update(block)
+        size+=len(block)
+        if compressor:
+          out.write(compressor.compress(block))
+    if compressor:
+      out.write(compressor.flush())
+      if out.tell()>=size:
+        out.close()
+        out=None
+        compress_type=zipfile.ZIP_STORED
+  except BaseException:
+    if out:
+      out.close()
+    raise
+  return compress_type,out,crc,size,digest.hexdigest()
+
+def _write_raw(zf,filename,arcname,compress_type,spool,crc,size):
+  """Append an entry compressed by compress_file() to an open ZipFile.
+
+  ZipFile has no public way to add data compressed elsewhere, so this
+  does what ZipFile.write() does itself; it is only used on the Python
+  versions in RAW_WRITES."""
+  zinfo=zipfile.ZipInfo.from_file(filename,arcname)
+  zinfo.compress_type=compress_type
+  zinfo.file_size=size
+  zinfo.compress_size=spool.seek(0,os.SEEK_END)
+  zinfo.CRC=crc
+  zinfo.flag_bits=LZMA_EOS_FLAG if compress_type==zipfile.ZIP_LZMA else 0
+  zip64=max(size,zinfo.compress_size)>zipfile.ZIP64_LIMIT
+  zf._writecheck(zinfo)
+  zf._didModify=True
+  zf.fp.seek(zf.start_dir)
+  zinfo.header_offset=zf.fp.tell()
+  zf.fp.write(zinfo.FileHeader(zip64))
+  spool.seek(0)
+  shutil.copyfileobj(spool,zf.fp,COPY_BUFFER)
+  zf.start_dir=zf.fp.tell()
+  zf.filelist.append(zinfo)
+  zf.NameToInfo[zinfo.filename]=zinfo
+
+def write_pak(pak_filename,entries,metadata,compression=DEFAULT_COMPRESSION,level=None,jobs=None):
+  """Write a pak of entries, a list of (filename,arcname), with metadata
+  (less its version) as the comment.
+
+  Files are compressed according to compression_for() on `jobs` threads
+  (None for one per cpu, fewer for lzma at high levels), through
+  temporary files so memory use doesn't grow with file size, and written
+  in the order given. An asset with
+  the same content as one already written is recorded in the manifest as
+  an alias of it instead. Returns PakStats."""
+  log=tts.logger()
+  if compression not in COMPRESSION_METHODS:
+    raise ValueError("Unknown compression %s" % compression)
+  if level is None:
+    level=DEFAULT_LEVEL
+  if compression=='lzma' and level!=DEFAULT_LEVEL and not RAW_WRITES:
+    # ZipFile itself always uses the default lzma preset.
+    log.warn("Compression level {} is only supported for lzma on Python 3.6 to 3.13; using {}.".format(level,DEFAULT_LEVEL))
+  if jobs is None:
+    jobs=os.cpu_count() or 1
+  jobs=compression_threads(compression,level,max(1,jobs))
+  start=time.monotonic()
+  raw_size=0
+  duplicate_size=0
+  # (digest,size) -> name of the asset stored with that content
+  stored={}
+  # name -> stored name
+  aliases=collections.OrderedDict()
+  with zipfile.ZipFile(pak_filename,'w') as zf, \
+       concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+    # Bound the temporary files in flight while keeping every thread busy.
+    work=iter(entries)
+    queued=collections.deque()
+    def submit():
+      for filename,arcname in work:
+        log.debug("Writing {} to {}".format(filename,arcname))
+        queued.append((filename,arcname,executor.submit(compress_file,filename,compression_for(filename,compression),level,RAW_WRITES)))
+        return
+    for _ in range(2*jobs):
+      submit()
+    while queued:
+      filename,arcname,future=queued.popleft()
+      submit()
+      compress_type,spool,crc,size,digest=future.result()
+      with spool or contextlib.nullcontext():
+        raw_size+=size
+        name=arcname.replace(os.sep,'/')
+        if is_asset(name):
+          if (digest,size) in stored:
+            log.debug("{} is the same as {}".format(name,stored[digest,size]))
+            aliases[name]=stored[digest,size]
+            duplicate_size+=size
+            continue
+          stored[digest,size]=name
+        if spool:
+          _write_raw(zf,filename,arcname,compress_type,spool,crc,size)
+        else:
+          zf.write(filename,arcname,compress_type,level)
+    files=len(zf.filelist)+len(aliases)
+    if aliases:
+      zf.writestr(MANIFEST_NAME,json.dumps({"Aliases":aliases}),zipfile.ZIP_DEFLATED)
+    zf.comment=json.dumps(dict(metadata,Ver=ALIAS_VERSION if aliases else PAK_VERSION)).encode('utf-8')
+  stats=PakStats(files,raw_size,os.path.getsize(pak_filename),time.monotonic()-start,
+                 len(aliases),duplicate_size)
+  log.info("Wrote {}: {}.".format(pak_filename,stats))
+  return stats
+
+def read_aliases(zf,metadata):
+  """The {alias:stored name} manifest of an open pak, or None if it is invalid."""
+  if metadata['Ver']<ALIAS_VERSION or MANIFEST_NAME not in zf.NameToInfo:
+    return {}
+  try:
+    aliases=json.loads(zf.read(MANIFEST_NAME).decode('utf-8'))['Aliases']
+  except (ValueError,KeyError,TypeError) as e:
+    tts.logger().error("Unreadable pak manifest ({})".format(e))
+    return None
+  if not isinstance(aliases,dict):
+    tts.logger().error("Unreadable pak manifest (Aliases is not an object)")
+    return None
+  for alias,name in aliases.items():
+    if not is_asset(alias) or not is_asset(name) or name not in zf.NameToInfo:
+      tts.logger().error("Invalid alias {} of {} in pak manifest".format(alias,name))
+      return None
+  return aliases
+
+def member_path(base,name):
+  """Where pak member name belongs under base, ignoring any '..' or
+  absolute parts as ZipFile.extract() does, or None for a directory."""
+  parts=[part for part in name.split('/') if part not in ('','.','..')]
+  if not parts or name.endswith('/'):
+    return None
+  return os.path.join(base,*parts)
+
+class ImportPlan:
+  """What importing a pak does, worked out from its central directory.
+
+  new, changed and unchanged are lists of (name,destination) of members,
+  and links of (stored name,destination) of the aliases to be written.
+  Aliases which are already installed are listed in unchanged, with the
+  name of the member they duplicate.
+  """
+  def __init__(self):
+    self.new=[]
+    self.changed=[]
+    self.unchanged=[]
+    self.links=[]
+    # name or alias destination -> (size,crc)
+    self.sizes={}
+    # member name -> destination
+    self.destinations={}
+
+  @property
+  def members(self):
+    """The members to be written."""
+    return self.new+self.changed
+
+  def _count(self,entries):
+    return len(entries),sum(self.sizes[name][0] for name,_ in entries)
+
+  def __str__(self):
+    lines=[]
+    for label,entries in (('new',self.new),('changed',self.changed)):
+      for name,destination in entries:
+        lines.append("{:<9}{}".format(label,destination))
+    for name,destination in self.links:
+      lines.append("{:<9}{} (same as {})".format('alias',destination,name))
+    counts=[]
+    for label,entries in (('new',self.new),('changed',self.changed),('unchanged',self.unchanged)):
+      count,size=self._count(entries)
+      counts.append("{} {} ({:.1f}MB)".format(count,label,size/1e6))
+    count,size=len(self.links),sum(self.sizes[destination][0] for _,destination in self.links)
+    counts.append("{} aliases ({:.1f}MB)".format(count,size/1e6))
+    lines.append(", ".join(counts))
+    return "\n".join(lines)
+
+def file_crc(filename,checksums):
+  """CRC-32 of filename, taken from the JsonStore checksums unless the
+  file has changed since it was recorded there."""
+  mtime,size=tts.catalog.file_signature(filename)
+  cached=checksums.get(filename)
+  if cached and cached[0]==mtime and cached[1]==size:
+    return cached[2]
+  crc=0
+  with open(filename,'rb') as fh:
+    for block in iter(lambda: fh.read(COPY_BUFFER),b''):
+      crc=zlib.crc32(block,crc)
+  checksums.set(filename,[mtime,size,crc])
+  return crc
+
+def _is_unchanged(destination,size,crc,checksums):
+  try:
+    if os.path.getsize(destination)!=size:
+      return False
+    return file_crc(destination,checksums)==crc
+  except OSError:
+    return False
+
+def plan_import(zf,metadata,filesystem,aliases,incremental=False):
+  """Where each member of an open pak is installed, as an ImportPlan.
+
+  Saves go under the save directory and everything else under the mod
+  directory; of the thumbnails, only the one for metadata's id is
+  installed, renamed to <id>.png.
+
+  If incremental, files already installed with the same size and CRC are
+  left alone; otherwise every file is written."""
+  plan=ImportPlan()
+  checksums=filesystem.checksums()
+  names=[name for name in zf.namelist() if name!=MANIFEST_NAME]
+  #select the thumbnail which matches the metadata id, else anything
+  thumbnails=[name for name in names if '/Thumbnails/' in name]
+  thumbnail=None
+  for thumbnail in thumbnails:
+    if metadata['Id'] in os.path.basename(thumbnail):
+      break
+
+  for name in names:
+    # Note that zips always use '/' as the seperator it seems.
+    splitname=name.split('/')
+    if len(splitname)>2 and splitname[2]=='Thumbnails':
+      if name!=thumbnail:
+        continue
+      #remove "Thumbnails" from the path
+      name_to='/'.join(splitname[0:2]+[os.path.extsep.join([metadata['Id'],'png'])])
+    else:
+      name_to=name
+    modpath=filesystem.basepath if splitname[0]=='Saves' else filesystem.modpath
+    destination=member_path(modpath,name_to)
+    if not destination:
+      continue
+    plan.destinations[name]=destination
+    info=zf.getinfo(name)
+    plan.sizes[name]=(info.file_size,info.CRC)
+    if not os.path.exists(destination):
+      plan.new.append((name,destination))
+    elif incremental and _is_unchanged(destination,info.file_size,info.CRC,checksums):
+      plan.unchanged.append((name,destination))
+    else:
+      plan.changed.append((name,destination))
+  for alias,name in aliases.items():
+    destination=member_path(filesystem.modpath,alias)
+    size,crc=plan.sizes[name]
+    plan.sizes[destination]=(size,crc)
+    if incremental and _is_unchanged(destination,size,crc,checksums):
+      plan.unchanged.append((name,destination))
+    else:
+      plan.links.append((name,destination))
+  return plan
+
+class StagedImport:
+  """Files written beside their destinations, to be moved into place
+  together by commit(), or removed by rollback(). Files may be staged
+  from several threads."""
+  def __init__(self):
+    # (temporary file,destination)
+    self.staged=[]
+    self._lock=threading.Lock()
+
+  def _stage(self,destination):
+    """A new temporary name beside destination, to be moved onto it."""
+    os.makedirs(os.path.dirname(destination),exist_ok=True)
+    temp=os.path.join(os.path.dirname(destination),'.'+uuid.uuid4().hex+STAGING_SUFFIX)
+    with self._lock:
+      self.staged.append((temp,destination))
+    return temp
+
+  def _temporary(self,destination):
+    temp=self._stage(destination)
+    # Created as open() would, so the umask applies as usual.
+    fd=os.open(temp,os.O_WRONLY|os.O_CREAT|os.O_EXCL|getattr(os,'O_BINARY',0),0o666)
+    return fd,temp
+
+  def extract(self,zf,name,destination):
+    """Stage member name of zf for destination, decompressing it once.
+
+    ZipExtFile checks the CRC as it reads, raising BadZipFile when the
+    member is corrupt."""
+    fd,temp=self._temporary(destination)
+    with os.fdopen(fd,'wb') as dst, zf.open(name) as src:
+      shutil.copyfileobj(src,dst,COPY_BUFFER)
+    return temp
+
+  def link(self,temp,destination):
+    """Stage a copy of the staged file temp for destination, as a
+    hardlink where possible."""
+    alias=self._stage(destination)
+    try:
+      os.link(temp,alias)
+    except OSError:
+      shutil.copyfile(temp,alias)
+
+  def commit(self):
+    """Move every staged file into place, replacing what was there."""
+    while self.staged:
+      temp,destination=self.staged[0]
+      os.replace(temp,destination)
+      self.staged.pop(0)
+
+  def rollback(self):
+    """Remove every staged file not yet committed."""
+    for temp,_ in self.staged:
+      try:
+        os.remove(temp)
+      except OSError:
+        pass
+    self.staged=[]
+
+def shard(members,sizes,count):
+  """Split members, a list of (name,destination), into at most count
+  lists of about the same total size (from sizes[name][0])."""
+  shards=[[] for _ in range(max(1,min(count,len(members))))]
+  totals=[(0,n) for n in range(len(shards))]
+  for member in sorted(members,key=lambda member: -sizes[member[0]][0]):
+    total,n=heapq.heappop(totals)
+    shards[n].append(member)
+    heapq.heappush(totals,(total+sizes[member[0]][0],n))
+  return shards
+
+def _extract_shard(zf,members,staging,staged,failed):
+  """Stage members of zf until done or failed is set. Returns
+  (name,exception) for a member which couldn't be extracted, or None."""
+  log=tts.logger()
+  for name,destination in members:
+    if failed.is_set():
+      return None
+    log.debug("Extracting {} to {}".format(name,destination))
+    try:
+      staged[name]=staging.extract(zf,name,destination)
+    except Exception as e:
+      # Corrupt data can raise BadZipFile, zlib.error, LZMAError or EOFError,
+      # and an unsupported compression method NotImplementedError.
+      failed.set()
+      return name,e
+  return None
+
+def _extract_shard_from(filename,members,staging,staged,failed):
+  # A ZipFile can't be read from several threads at once, so each worker has its own.
+  try:
+    zf=zipfile.ZipFile(filename,'r')
+  except Exception as e:
+    failed.set()
+    return filename,e
+  with zf:
+    return _extract_shard(zf,members,staging,staged,failed)
+
+def install(zf,plan,checksums=None,jobs=1):
+  """Write the members and aliases of an ImportPlan, so that either all of
+  them are installed or none. The CRC of each file written is recorded in
+  the JsonStore checksums, if given. Returns True on success.
+
+  Members are extracted on `jobs` threads (None for one per cpu), each
+  reading its own share of them through its own handle on the pak."""
+  log=tts.logger()
+  if jobs is None:
+    jobs=os.cpu_count() or 1
+  staging=StagedImport()
+  staged={}
+  failed=threading.Event()
+  members=plan.members
+  # Whatever happens, no staged file is left behind.
+  try:
+    if jobs<=1 or len(members)<=1:
+      errors=[_extract_shard(zf,members,staging,staged,failed)]
+    else:
+      shards=shard(members,plan.sizes,jobs)
+      log.info("Extracting {} files using {} threads.".format(len(members),len(shards)))
+      with concurrent.futures.ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        try:
+          errors=list(executor.map(lambda members: _extract_shard_from(zf.filename,members,staging,staged,failed),shards))
+        except BaseException:
+          failed.set()
+          raise
+    errors=[error for error in errors if error]
+    if errors:
+      for name,e in errors:
+        log.error("Unable to extract {} ({}); nothing was imported.".format(name,e))
+      staging.rollback()
+      return False
+    try:
+      for stored,destination in plan.links:
+        log.debug("Linking {} to {}".format(destination,stored))
+        # The stored file may be installed already, and unchanged.
+        staging.link(staged.get(stored,plan.destinations[stored]),destination)
+    except OSError as e:
+      log.error("Unable to link aliases ({}); nothing was imported.".format(e))
+      staging.rollback()
+      return False
+    try:
+      staging.commit()
+    except OSError as e:
+      log.error("Unable to move imported files into place ({}); the import is incomplete.".format(e))
+      staging.rollback()
+      return False
+  except BaseException:
+    staging.rollback()
+    raise
+  if checksums is not None:
+    written=[(destination,plan.sizes[name][1]) for name,destination in plan.members]
+    written+=[(destination,plan.sizes[destination][1]) for _,destination in plan.links]
+    for destination,crc in written:
+      try:
+        mtime,size=tts.catalog.file_signature(destination)
+      except OSError:
+        continue
+      checksums.set(destination,[mtime,size,crc])
+  return True
@@ -0,0 +1,97 @@
+import collections
+import threading
+import tts
+
+class DownloadPlan:
+  """The missing assets of a number of saves, each downloaded only once.
+
+  Urls which strip to the same name share a file in the cache, so only the
+  first of them is downloaded. Only a summary of each save is kept.
+
+  If refresh is set, every asset is planned, not just the missing ones,
+  so that a refreshing Downloader can check them for changes.
+
+  prioritise() moves a mod's assets to the front, before or during run().
+  """
+  def __init__(self,filesystem,refresh=False):
+    self.filesystem=filesystem
+    self.refresh=refresh
+    self.saves=[]
+    # stripped name -> the Url which will be downloaded for it
+    self.assets=collections.OrderedDict()
+    # stripped name -> idents of the saves which use it
+    self.owners=collections.defaultdict(list)
+    self.wanted=0
+    self.first=[]
+    self.downloader=None
+    self._lock=threading.Lock()
+
+  def add(self,save):
+    """Add the missing (or, when refreshing, all) assets of a Save to the plan."""
+    self.saves.append(save.summary())
+    for url in (save.urls if self.refresh else save.missing):
+      self.wanted+=1
+      self.assets.setdefault(url.stripped_url,url)
+      self.owners[url.stripped_url].append(save.ident)
+
+  def prioritise(self,ident):
+    """Download the assets of save ident before any others."""
+    with self._lock:
+      self.first.append(ident)
+      downloader=self.downloader
+    if downloader:
+      downloader.prioritise(ident)
+
+  def __len__(self):
+    return len(self.assets)
+
+  def run(self,downloader=None):
+    """Download every planned asset, carrying on past failures.
+
+    Returns a PlanReport."""
+    log=tts.logger()
+    log.info("{} {}assets in {} saves, {} to {}.".format(
+      self.wanted,"" if self.refresh else "missing ",len(self.saves),len(self.assets),
+      "check" if self.refresh else "download"))
+    if downloader is None:
+      downloader=tts.Downloader()
+    with self._lock:
+      self.downloader=downloader
+      for ident in self.first:
+        downloader.prioritise(ident)
+    owners=dict((url.url,self.owners[stripped]) for stripped,url in self.assets.items())
+    try:
+      results=downloader.download(self.assets.values(),owners)
+    finally:
+      with self._lock:
+        self.downloader=None
+    missing=[]
+    for save in self.saves:
+      if not save.missing:
+        continue
+      still=[r.url for r in self.filesystem.resolve_many(url.url for url in save.missing) if not r.location]
+      if still:
+        missing.append((save,still))
+    return PlanReport(results,missing)
+
+class PlanReport:
+  """What a DownloadPlan did: the DownloadResults of its downloads, and
+  (SaveSummary,urls) for each save which still has missing urls."""
+  def __init__(self,results,missing):
+    self.results=results
+    self.missing=missing
+
+  @property
+  def successful(self):
+    return self.results.error is None and not self.missing
+
+  def __str__(self):
+    result=self.results.summary()
+    if not self.missing:
+      return result
+    result+="\n{} saves still have missing files:".format(len(self.missing))
+    for save,urls in self.missing:
+      result+="\n%s (%s): %d missing" % (save.save_name,save.ident,len(urls))
+      for url in urls:
+        result+="\n  %s" % url
+    return result
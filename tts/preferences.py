@@ -31,6 +31,10 @@ class Preferences(object):
     self._TTSLocation = ''
     self._defaultSaveLocation = ''
     self._firstRun = False
+    self._connectTimeout = tts.connection.DEFAULT_CONNECT_TIMEOUT
+    self._readTimeout = tts.connection.DEFAULT_READ_TIMEOUT
+    self._retries = tts.download.DEFAULT_RETRIES
+    self._breakerThreshold = tts.download.DEFAULT_BREAKER_THRESHOLD
     #child class must initialize these properly (load from disk or assign defaults)
 
   @property
@@ -78,17 +82,65 @@ class Preferences(object):
     self._firstRun=bool(value)
     self.changed=True
 
+  @property
+  def connectTimeout(self):
+    return self._connectTimeout
+
+  @connectTimeout.setter
+  def connectTimeout(self,value):
+    if self._connectTimeout==float(value):
+      return
+    self._connectTimeout=float(value)
+    self.changed=True
+
+  @property
+  def readTimeout(self):
+    return self._readTimeout
+
+  @readTimeout.setter
+  def readTimeout(self,value):
+    if self._readTimeout==float(value):
+      return
+    self._readTimeout=float(value)
+    self.changed=True
+
+  @property
+  def retries(self):
+    return self._retries
+
+  @retries.setter
+  def retries(self,value):
+    if self._retries==int(value):
+      return
+    self._retries=int(value)
+    self.changed=True
+
+  @property
+  def breakerThreshold(self):
+    return self._breakerThreshold
+
+  @breakerThreshold.setter
+  def breakerThreshold(self,value):
+    if self._breakerThreshold==int(value):
+      return
+    self._breakerThreshold=int(value)
+    self.changed=True
+
   def reset(self):
     self._locationIsUser=True
     self._firstRun=1
     self._defaultSaveLocation=""
     self._TTSLocation=""
+    self._connectTimeout=tts.connection.DEFAULT_CONNECT_TIMEOUT
+    self._readTimeout=tts.connection.DEFAULT_READ_TIMEOUT
+    self._retries=tts.download.DEFAULT_RETRIES
+    self._breakerThreshold=tts.download.DEFAULT_BREAKER_THRESHOLD
     #child class must delete values from disk storage
 
   def save(self):
     # No longer first run.
     self.firstRun=0
-    #Child class must save all 4 values to disk storage
+    #Child class must save all 8 values to disk storage
 
   def validate(self):
     return self.get_filesystem().check_dirs()
@@ -98,12 +150,27 @@ class Preferences(object):
       return tts.get_default_fs()
     return tts.filesystem.FileSystem(tts_install_path=self.TTSLocation)
 
+  def get_downloader(self,connect_timeout=None,read_timeout=None,retries=None,breaker_threshold=None,**kwargs):
+    """A Downloader using the preferred timeouts and retry policy, unless
+    overridden. Other arguments are passed on to the Downloader."""
+    pool=tts.connection.ConnectionPool(
+      connect_timeout=self.connectTimeout if connect_timeout is None else connect_timeout,
+      read_timeout=self.readTimeout if read_timeout is None else read_timeout)
+    return tts.Downloader(pool=pool,
+                          retries=self.retries if retries is None else retries,
+                          breaker_threshold=self.breakerThreshold if breaker_threshold is None else breaker_threshold,
+                          **kwargs)
+
   def __str__(self):
     return f"""Preferences:
 locationIsUser: {self.locationIsUser}
 TTSLocation: {self.TTSLocation}
 DefaultSaveLocation: {self.defaultSaveLocation}
-firstRun: {self.firstRun}"""
+firstRun: {self.firstRun}
+connectTimeout: {self.connectTimeout}
+readTimeout: {self.readTimeout}
+retries: {self.retries}
+breakerThreshold: {self.breakerThreshold}"""
 
 
 class PreferencesWin(Preferences):
@@ -128,6 +195,22 @@ class PreferencesWin(Preferences):
       self._firstRun="True"==winreg.QueryValueEx(self._registry,"firstRun")[0]
     except FileNotFoundError as e:
       self._firstRun=True
+    try:
+      self._connectTimeout=float(winreg.QueryValueEx(self._registry,"connectTimeout")[0])
+    except (FileNotFoundError,ValueError) as e:
+      self._connectTimeout=tts.connection.DEFAULT_CONNECT_TIMEOUT
+    try:
+      self._readTimeout=float(winreg.QueryValueEx(self._registry,"readTimeout")[0])
+    except (FileNotFoundError,ValueError) as e:
+      self._readTimeout=tts.connection.DEFAULT_READ_TIMEOUT
+    try:
+      self._retries=int(winreg.QueryValueEx(self._registry,"retries")[0])
+    except (FileNotFoundError,ValueError) as e:
+      self._retries=tts.download.DEFAULT_RETRIES
+    try:
+      self._breakerThreshold=int(winreg.QueryValueEx(self._registry,"breakerThreshold")[0])
+    except (FileNotFoundError,ValueError) as e:
+      self._breakerThreshold=tts.download.DEFAULT_BREAKER_THRESHOLD
 
   def reset(self):
     super().reset()
@@ -135,6 +218,11 @@ class PreferencesWin(Preferences):
     winreg.DeleteValue(self._registry,"TTSLocation")
     winreg.DeleteValue(self._registry,"defaultSaveLocation")
     winreg.DeleteValue(self._registry,"firstRun")
+    for name in ["connectTimeout","readTimeout","retries","breakerThreshold"]:
+      try:
+        winreg.DeleteValue(self._registry,name)
+      except FileNotFoundError:
+        pass
 
   def save(self):
     super().save()
@@ -143,6 +231,10 @@ class PreferencesWin(Preferences):
     winreg.SetValueEx(self._registry,"TTSLocation",0,winreg.REG_SZ,str(self.TTSLocation))
     winreg.SetValueEx(self._registry,"defaultSaveLocation",0,winreg.REG_SZ,str(self.defaultSaveLocation))
     winreg.SetValueEx(self._registry,"firstRun",0,winreg.REG_SZ,str(self._firstRun))
+    winreg.SetValueEx(self._registry,"connectTimeout",0,winreg.REG_SZ,str(self.connectTimeout))
+    winreg.SetValueEx(self._registry,"readTimeout",0,winreg.REG_SZ,str(self.readTimeout))
+    winreg.SetValueEx(self._registry,"retries",0,winreg.REG_SZ,str(self.retries))
+    winreg.SetValueEx(self._registry,"breakerThreshold",0,winreg.REG_SZ,str(self.breakerThreshold))
 
 
 class PreferencesLinux(Preferences):
@@ -154,12 +246,33 @@ class PreferencesLinux(Preferences):
     self._config['main'] = {'locationIsUser': 'yes',
                          'TTSLocation': '',
                          'defaultSaveLocation': '',
-                         'firstRun': '0'}
+                         'firstRun': '0',
+                         'connectTimeout': str(tts.connection.DEFAULT_CONNECT_TIMEOUT),
+                         'readTimeout': str(tts.connection.DEFAULT_READ_TIMEOUT),
+                         'retries': str(tts.download.DEFAULT_RETRIES),
+                         'breakerThreshold': str(tts.download.DEFAULT_BREAKER_THRESHOLD)}
     self._config.read(self._conffile, encoding='utf-8')
     self._locationIsUser = self._config['main'].getboolean('locationIsUser')
     self._TTSLocation = self._config['main']['TTSLocation']
     self._defaultSaveLocation = self._config['main']['defaultSaveLocation']
     self._firstRun = self._config['main'].getboolean('load_firstRun')
+    self._connectTimeout = self._getNumber('connectTimeout',float,tts.connection.DEFAULT_CONNECT_TIMEOUT,0)
+    self._readTimeout = self._getNumber('readTimeout',float,tts.connection.DEFAULT_READ_TIMEOUT,0)
+    self._retries = self._getNumber('retries',int,tts.download.DEFAULT_RETRIES)
+    self._breakerThreshold = self._getNumber('breakerThreshold',int,tts.download.DEFAULT_BREAKER_THRESHOLD)
+
+  def _getNumber(self,name,convert,default,above=None):
+    """The number saved as name, or default if it isn't valid (or isn't
+    more than above)."""
+    value=self._config['main'][name]
+    try:
+      number=convert(value)
+    except ValueError:
+      number=None
+    if number is None or (above is not None and not number>above):
+      tts.logger().warn("Ignoring invalid {} '{}' in {}, using {}.".format(name,value,self._conffile,default))
+      return default
+    return number
 
   def reset(self):
     super().reset()
@@ -173,6 +286,10 @@ class PreferencesLinux(Preferences):
     self._config['main']['TTSLocation'] = self._TTSLocation
     self._config['main']['defaultSaveLocation'] = self._defaultSaveLocation
     self._config['main']['firstRun'] = 'yes' if self._firstRun else 'no'
+    self._config['main']['connectTimeout'] = str(self._connectTimeout)
+    self._config['main']['readTimeout'] = str(self._readTimeout)
+    self._config['main']['retries'] = str(self._retries)
+    self._config['main']['breakerThreshold'] = str(self._breakerThreshold)
     with open(self._conffile, 'w') as configfile:
       self._config.write(configfile)
 
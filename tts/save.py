@@ -4,128 +4,191 @@ import tts
 import zipfile
 import json
 import urllib.error
+import logging
 
-PAK_VER=2
+# The newest pak version importPak understands.
+PAK_VER=tts.pak.ALIAS_VERSION
+# Saves larger than this are streamed rather than loaded when only their
+# assets are needed.
+STREAM_THRESHOLD=32*1024*1024
 
-def importPak(filesystem,filename):
+def _open_pak(filename):
+  """Open a pak for reading, returning (ZipFile,metadata,aliases), or
+  None if it isn't a valid pak."""
   log=tts.logger()
-  log.debug("About to import {} into {}.".format(filename,filesystem))
   if not os.path.isfile(filename):
     log.error("Unable to find mod pak {}".format(filename))
-    return False
+    return None
   if not zipfile.is_zipfile(filename):
     log.error("Mod pak {} format appears corrupt.".format(filename))
-    return False
-  try:
-    with zipfile.ZipFile(filename,'r') as zf:
-      bad_file=zf.testzip()
-      if bad_file:
-        log.error("At least one corrupt file found in {} - {}".format(filename,bad_file))
-        return False
-      if not zf.comment:
-        # TODO: allow overrider
-        log.error("Missing pak header comment in {}. Aborting import.".format(filename))
-        return False
-      metadata=json.loads(zf.comment.decode('utf-8'))
-      if not tts.validate_metadata(metadata, PAK_VER):
-        log.error(f"Invalid pak header '{metadata}' in {filename}. Aborting import.")
-        return False
-      log.info(f"Extracting {metadata['Type']} pak for id {metadata['Id']} (pak version {metadata['Ver']})")
-
-      #select the thumbnail which matches the metadata id, else anything
-      names = zf.namelist()
-      thumbnails = [name for name in names if '/Thumbnails/' in name]
-      thumbnail = None
-      for thumbnail in thumbnails:
-        if metadata['Id'] in os.path.basename(thumbnail):
-          break
-
-      outname=None
-      for name in names:
-        # Note that zips always use '/' as the seperator it seems.
-        splitname = name.split('/')
-        if len(splitname) > 2 and splitname[2] == 'Thumbnails':
-          if name == thumbnail:
-            #remove "Thumbnails" from the path
-            outname='/'.join(splitname[0:2] + [os.path.extsep.join([metadata['Id'],'png'])])
-          else:
-            outname=None
-            continue
+    return None
+  zf=zipfile.ZipFile(filename,'r')
+  if not zf.comment:
+    # TODO: allow overrider
+    log.error("Missing pak header comment in {}. Aborting import.".format(filename))
+    zf.close()
+    return None
+  metadata=json.loads(zf.comment.decode('utf-8'))
+  if not tts.validate_metadata(metadata, PAK_VER):
+    log.error(f"Invalid pak header '{metadata}' in {filename}. Aborting import.")
+    zf.close()
+    return None
+  aliases=tts.pak.read_aliases(zf,metadata)
+  if aliases is None:
+    log.error(f"Invalid manifest in {filename}. Aborting import.")
+    zf.close()
+    return None
+  return zf,metadata,aliases
 
-        start=splitname[0]
-        if start=='Saves':
-          modpath=filesystem.basepath
-        else:
-          modpath=filesystem.modpath
-        log.debug(f"Extracting {name} to {modpath}")
-        zf.extract(name,modpath)
-        if outname:
-          log.debug(f"Renaming {name} to {outname}")
-          os.rename(os.path.join(modpath,name), os.path.join(modpath,outname))
-          try:
-            outdir = os.path.dirname(os.path.join(modpath,name))
-            os.rmdir(outdir)
-          except OSError:
-            log.debug(f"Can't remove dir {outdir}")
+def planPak(filesystem,filename,incremental=True):
+  """What importing a pak would do, as a tts.pak.ImportPlan, or None if
+  the pak can't be read. Only its central directory is read, and nothing
+  is written (not even the checksums it works out)."""
+  log=tts.logger()
+  try:
+    pak=_open_pak(filename)
+    if not pak:
+      return None
+    zf,metadata,aliases=pak
+    with zf:
+      plan=tts.pak.plan_import(zf,metadata,filesystem,aliases,incremental)
+  except zipfile.BadZipFile as e:
+    log.error("Mod pak {} format appears corrupt - {}.".format(filename,e))
+    return None
+  return plan
 
+def importPak(filesystem,filename,incremental=False,jobs=1):
+  """Install a pak, extracting it on `jobs` threads (None for one per
+  cpu). If incremental, files which are already installed and identical
+  are not written again. Returns True on success."""
+  log=tts.logger()
+  log.debug("About to import {} into {}.".format(filename,filesystem))
+  try:
+    pak=_open_pak(filename)
+    if not pak:
+      return False
+    zf,metadata,aliases=pak
+    with zf:
+      log.info(f"Extracting {metadata['Type']} pak for id {metadata['Id']} (pak version {metadata['Ver']})")
+      plan=tts.pak.plan_import(zf,metadata,filesystem,aliases,incremental)
+      log.info(str(plan).splitlines()[-1])
+      # Each member is checked as it is extracted; nothing is installed
+      # unless all of them are intact.
+      if not tts.pak.install(zf,plan,filesystem.checksums(),jobs):
+        return False
   except zipfile.BadZipFile as e:
     log.error("Mod pak {} format appears corrupt - {}.".format(filename,e))
+    return False
   except zipfile.LargeZipFile as e:
     log.error("Mod pak {} requires large zip capability - {}.\nThis shouldn't happen - please raise a bug.".format(filename,e))
+    return False
+  finally:
+    filesystem.checksums().save()
+  filesystem.refresh_index()
   log.info("Imported {} successfully.".format(filename))
   return True
 
-def get_save_urls(savedata):
+# String values under these keys are never treated as urls (tablet state / rulebooks).
+EXCLUDED_URL_KEYS=frozenset(['PageURL','Rules'])
+URL_PROTOCOLS=frozenset(['http','https','ftp'])
+
+def iter_save_urls(savedata,with_path=False):
   '''
-  Iterate over all the values in the json file, building a (key,value) set of
-  all the values whose key ends in "URL"
+  Yield every url in the json data of a save: the non-empty string values
+  whose key ends in "URL", and any other string value which looks like an
+  http/https/ftp url. Urls may be yielded more than once.
+
+  If with_path is set, yields (path,url) where path is the tuple of keys
+  and list indices leading to the url.
+
+  This walks the data with an explicit stack, so deeply nested saves can't
+  hit the recursion limit.
   '''
   log=tts.logger()
-  def parse_list(data):
-    urls=set()
-    for item in data:
-      urls |= get_save_urls(item)
-    return urls
-  def parse_dict(data):
-    urls=set()
-    if not data:
-      return urls
-    for key in data:
-      if type(data[key]) is not str or key=='PageURL' or key=='Rules':
-        # If it isn't a string, it can't be an url.
-        # Also don't save tablet state / rulebooks
-        continue
-      if key.endswith('URL') and data[key]!='':
-        log.debug("Found {}:{}".format(key,data[key]))
-        urls.add(data[key])
-        continue
-      protocols=data[key].split('://')
-      if len(protocols)==1:
-        # not an url
-        continue
-      if protocols[0] in ['http','https','ftp']:
-        # belt + braces.
-        urls.add(data[key])
-        log.debug("Found {}:{}".format(key,data[key]))
-        continue
-    for item in data.values():
-      urls |= get_save_urls(item)
-    return urls
-
-  if type(savedata) is list:
-    return parse_list(savedata)
-  if type(savedata) is dict:
-    return parse_dict(savedata)
-  return set()
+  debug=log.isEnabledFor(logging.DEBUG)
+  stack=[(savedata,())]
+  while stack:
+    data,path=stack.pop()
+    if type(data) is dict:
+      for key,value in data.items():
+        if type(value) is str:
+          if key in EXCLUDED_URL_KEYS or not value:
+            continue
+          if not key.endswith('URL'):
+            protocol,separator,_=value.partition('://')
+            if not separator or protocol not in URL_PROTOCOLS:
+              continue
+          if debug:
+            log.debug("Found {}:{}".format(key,value))
+          if with_path:
+            yield path+(key,),value
+          else:
+            yield value
+        elif type(value) is dict or type(value) is list:
+          stack.append((value,path+(key,) if with_path else path))
+    elif type(data) is list:
+      for index,item in enumerate(data):
+        if type(item) is dict or type(item) is list:
+          stack.append((item,path+(index,) if with_path else path))
 
+def get_save_urls(savedata):
+  '''
+  Return the set of all the urls in the json data of a save (see
+  iter_save_urls).
+  '''
+  return set(iter_save_urls(savedata))
+
+def read_save_file(filename):
+  '''
+  Return the SaveName and set of urls of a save file, or None if it can't
+  be decoded. Large files are streamed, so their json is never held in
+  memory. Raises OSError, ValueError or KeyError if the save is unreadable
+  or malformed.
+  '''
+  if os.path.getsize(filename)>=STREAM_THRESHOLD:
+    tts.logger().info("Streaming urls from %s" % filename)
+    return tts.read_save_name(filename),tts.jsonstream.stream_save_urls(filename)
+  data=tts.load_json_file(filename)
+  if not data:
+    return None
+  return data['SaveName'],get_save_urls(data)
+
+
+class SaveSummary:
+  """The name and resolved assets of a save, without its json or anything
+  needed to export it."""
+  __slots__=('ident','save_type','save_name','filename','missing','images','models')
+
+  def __init__(self,ident,save_type,save_name,filename,missing,images,models):
+    self.ident=ident
+    self.save_type=save_type
+    self.save_name=save_name
+    self.filename=filename
+    self.missing=tuple(missing)
+    self.images=tuple(images)
+    self.models=tuple(models)
+
+  @property
+  def isInstalled(self):
+    return len(self.missing)==0
+
+  def __str__(self):
+    return "{}: {} missing, {} images, {} models".format(
+      self.save_name,len(self.missing),len(self.images),len(self.models))
 
 class Save:
-  def __init__(self,savedata,filename,ident,filesystem,save_type=SaveType.workshop):
+  def __init__(self,savedata,filename,ident,filesystem,save_type=SaveType.workshop,save_name=None,urls=None,keep_data=True):
+    """savedata may be None if both save_name and urls are given.
+
+    Unless keep_data is set, savedata is dropped once the name and urls
+    have been taken from it, leaving self.data None."""
     log=tts.logger()
     self.data = savedata
     self.ident=ident
-    if self.data['SaveName']:
-      self.save_name=self.data['SaveName']
+    if save_name is None:
+      save_name=self.data['SaveName']
+    if save_name:
+      self.save_name=save_name
     else:
       self.save_name=self.ident
     self.save_type=save_type
@@ -143,70 +206,114 @@ class Save:
       fileparts=fileparts[1:]
     self.basename=os.path.join(*fileparts)
     log.debug("filename: {},save_name: {}, basename: {}".format(self.filename,self.save_name,self.basename))
-    self.urls = [ Url(url,self.filesystem) for url in get_save_urls(savedata) ]
-    self.missing = [ x for x in self.urls if not x.exists ]
-    self.images=[ x for x in self.urls if x.exists and x.isImage ]
-    self.models=[ x for x in self.urls if x.exists and not x.isImage ]
+    if urls is None:
+      urls=get_save_urls(savedata)
+    self.urls = [ Url(r.url,self.filesystem,r) for r in self.filesystem.resolve_many(urls) ]
+    self._sort_urls()
+    if not keep_data:
+      self.data=None
     log.debug("Urls found {}:{} missing, {} models, {} images".format(len(self.urls),len(self.missing),len(self.models),len(self.images)))
 
-  def export(self,export_filename):
+  @classmethod
+  def from_file(cls,filename,ident,filesystem,save_type=SaveType.workshop):
+    """Build a Save which only knows the name and assets of a save file.
+
+    Large files are streamed, so their json is never held in memory.
+    Returns None if the file can't be read."""
+    log=tts.logger()
+    try:
+      result=read_save_file(filename)
+    except (OSError,ValueError,KeyError) as e:
+      log.error("Unable to read data file %s (%s)" % (filename,e))
+      return None
+    if not result:
+      return None
+    save_name,urls=result
+    return cls(savedata=None,
+               filename=filename,
+               ident=ident,
+               filesystem=filesystem,
+               save_type=save_type,
+               save_name=save_name,
+               urls=urls)
+
+  def export(self,export_filename,compression=tts.pak.DEFAULT_COMPRESSION,level=None,jobs=None):
+    """Write this save and its cached files to a pak, returning PakStats.
+
+    Images are stored; other files use compression ('store', 'deflate' or
+    'lzma') at level, on `jobs` threads."""
     log=tts.logger()
     log.info("About to export %s to %s" % (self.ident,export_filename))
     zfs = tts.filesystem.FileSystem(base_path="")
-    zipComment = {
-      "Ver":PAK_VER,
+    metadata = {
       "Id":self.ident,
       "Type":self.save_type.name
     }
 
+    entries=[(self.filename,zfs.get_path_by_type(os.path.basename(self.filename),self.save_type))]
+    if self.thumbnail:
+      filepath=zfs.get_path_by_type(os.path.basename(self.thumbnail),self.save_type)
+      entries.append((self.thumbnail,os.path.join(os.path.dirname(filepath),'Thumbnails',os.path.basename(filepath))))
+    for url in self.models:
+      entries.append((url.location,zfs.get_model_path(os.path.basename(url.location))))
+    for url in self.images:
+      entries.append((url.location,zfs.get_image_path(os.path.basename(url.location))))
+    # Urls which strip to the same name share a file; pack it once.
+    seen=set()
+    entries=[entry for entry in entries if not (entry[1] in seen or seen.add(entry[1]))]
+
     # TODO: error checking.
-    with zipfile.ZipFile(export_filename,'w') as zf:
-      zf.comment=json.dumps(zipComment).encode('utf-8')
-      log.debug("Writing {} (base {}) to {}".format(self.filename,os.path.basename(self.filename),zfs.get_path_by_type(os.path.basename(self.filename),self.save_type)))
-      zf.write(self.filename,zfs.get_path_by_type(os.path.basename(self.filename),self.save_type))
-      if self.thumbnail:
-        filepath=zfs.get_path_by_type(os.path.basename(self.thumbnail),self.save_type)
-        arcname=os.path.join(os.path.dirname(filepath), 'Thumbnails', os.path.basename(filepath))
-        zf.write(self.thumbnail,arcname=arcname)
-        log.debug(f"Writing {self.thumbnail} to {arcname}")
-      for url in self.models:
-        log.debug("Writing {} to {}".format(url.location,zfs.get_model_path(os.path.basename(url.location))))
-        zf.write(url.location,zfs.get_model_path(os.path.basename(url.location)))
-      for url in self.images:
-        log.debug("Writing {} to {}".format(url.location,zfs.get_model_path(os.path.basename(url.location))))
-        zf.write(url.location,zfs.get_image_path(os.path.basename(url.location)))
+    stats=tts.pak.write_pak(export_filename,entries,metadata,compression,level,jobs)
     log.info("File exported.")
+    return stats
 
   @property
   def isInstalled(self):
     """Is every url referenced by this save installed?"""
     return len(self.missing)==0
 
-  def download(self):
+  def summary(self):
+    """A SaveSummary of this save as it is now."""
+    return SaveSummary(self.ident,self.save_type,self.save_name,self.filename,
+                       self.missing,self.images,self.models)
+
+  def download(self,downloader=None):
+    """Download any missing files, returning a DownloadResults.
+
+    If the downloader refreshes, every file is checked for changes."""
     log=tts.logger()
     log.warn("About to download files for %s" % self.save_name)
+    if downloader is None:
+      downloader=tts.Downloader()
+    if downloader.refresh:
+      log.warn("Refreshing {} files for {}".format(len(self.urls),self.save_name))
+      results=downloader.download(self.urls)
+      self._sort_urls()
+      return results
     if self.isInstalled==True:
       log.info("All files already downloaded.")
-      return True
-
-    successful=True
-    url_counter=1
-    for url in self.missing:
-      log.warn("Downloading file {} of {} for {}".format(url_counter,len(self.missing),self.save_name))
-      result = url.download()
-      if not result:
-        successful=False
-      url_counter+=1
-
-    #TODO:: remove items from missing list.
-    return successful
+      return tts.DownloadResults()
 
+    log.warn("Downloading {} files for {}".format(len(self.missing),self.save_name))
+    results=downloader.download(self.missing)
+    self._sort_urls()
+    return results
 
-    log.info("All files downloaded.")
-    return True
+  def _sort_urls(self):
+    """Split urls into missing, images and models."""
+    self.missing=[]
+    self.images=[]
+    self.models=[]
+    for url in self.urls:
+      if not url.exists:
+        self.missing.append(url)
+      elif url.isImage:
+        self.images.append(url)
+      else:
+        self.models.append(url)
 
   def __str__(self):
-    result = "Save: %s\n" % self.data['SaveName']
+    result = "Save: %s\n" % self.save_name
     if len(self.missing)>0:
       result += "Missing:\n"
       for x in self.missing:
@@ -220,4 +327,4 @@ class Save:
       for x in self.models:
         result += str(x)+"\n"
     return result
-__all__ = [ 'Save' ]
+__all__ = [ 'Save','SaveSummary' ]
@@ -0,0 +1,60 @@
+import os
+import collections
+import concurrent.futures
+import tts
+
+# Compact summary of a save; the json itself never leaves the worker.
+ScanResult=collections.namedtuple('ScanResult',['ident','save_type','filename','name','urls'])
+
+def _init_worker(level):
+  tts.logger().setLevel(level)
+
+def scan_file(filename):
+  """Read a save, returning (name,urls) or None if it can't be read."""
+  try:
+    result=tts.save.read_save_file(filename)
+    if not result:
+      return None
+    return result[0],frozenset(result[1])
+  except (ValueError,KeyError,TypeError,OSError) as e:
+    tts.logger().error("Unable to read %s (%s)" % (filename,e))
+    return None
+
+def scan_files(filenames,jobs=1):
+  """Yield (filename,scan_file(filename)) for each file, spreading the
+  work over `jobs` processes (None for one per cpu)."""
+  filenames=list(filenames)
+  if jobs is None:
+    jobs=os.cpu_count() or 1
+  if jobs<=1 or len(filenames)<=1:
+    for filename in filenames:
+      yield filename,scan_file(filename)
+    return
+  jobs=min(jobs,len(filenames))
+  tts.logger().info("Scanning {} saves using {} processes.".format(len(filenames),jobs))
+  with concurrent.futures.ProcessPoolExecutor(max_workers=jobs,
+                                              initializer=_init_worker,
+                                              initargs=(tts.logger().level,)) as executor:
+    chunksize=max(1,min(16,len(filenames)//(jobs*4)))
+    yield from zip(filenames,executor.map(scan_file,filenames,chunksize=chunksize))
+
+def scan_library(filesystem,save_types=None,jobs=1):
+  """Read the name and urls of every save of the given types (default all).
+
+  Returns a list of ScanResult."""
+  if save_types is None:
+    save_types=list(tts.SaveType)
+  files={}
+  for save_type in save_types:
+    for ident in filesystem.get_filenames_by_type(save_type):
+      filename=filesystem.get_json_filename_for_type(ident,save_type)
+      if filename:
+        files[filename]=(ident,save_type)
+  results=[]
+  for filename,result in scan_files(files,jobs):
+    if not result:
+      tts.logger().error("Unable to read data file %s" % filename)
+      continue
+    ident,save_type=files[filename]
+    results.append(ScanResult(ident,save_type,filename,result[0],result[1]))
+  return results
@@ -0,0 +1,88 @@
+import os
+import json
+import threading
+import tts
+from .filelock import FileLock
+
+class JsonStore:
+  """A dict of json-serialisable values kept in a json file.
+
+  Changes are held in memory until save(), which merges them into the
+  file as it is then and replaces it atomically, so several processes can
+  share one store. Safe to use from several threads.
+  """
+  def __init__(self,filename):
+    self.filename=filename
+    self._lock=threading.Lock()
+    self._data=self._load()
+    self._dirty=False
+    # What save() has to apply to the file: key -> value, and removed keys.
+    self._changes={}
+    self._removed=set()
+
+  def _load(self):
+    try:
+      with open(self.filename,'r',encoding='utf-8') as fh:
+        data=json.load(fh)
+    except FileNotFoundError:
+      return {}
+    except (OSError,ValueError) as e:
+      tts.logger().warn("Unable to read %s, starting again (%s)" % (self.filename,e))
+      return {}
+    if not isinstance(data,dict):
+      return {}
+    return data
+
+  def get(self,key,default=None):
+    with self._lock:
+      return self._data.get(key,default)
+
+  def set(self,key,value):
+    with self._lock:
+      self._data[key]=value
+      self._changes[key]=value
+      self._removed.discard(key)
+      self._dirty=True
+
+  def pop(self,key,default=None):
+    with self._lock:
+      if key not in self._data:
+        return default
+      self._changes.pop(key,None)
+      self._removed.add(key)
+      self._dirty=True
+      return self._data.pop(key)
+
+  def __contains__(self,key):
+    with self._lock:
+      return key in self._data
+
+  def __len__(self):
+    with self._lock:
+      return len(self._data)
+
+  def save(self):
+    """Write any changes to disk, returning False if that failed."""
+    with self._lock:
+      if not self._dirty:
+        return True
+      tempname=self.filename+'.tmp'
+      try:
+        os.makedirs(os.path.dirname(self.filename),exist_ok=True)
+        with FileLock(self.filename+'.lock'):
+          # Keep whatever other processes have saved since we loaded.
+          data=self._load()
+          data.update(self._changes)
+          for key in self._removed:
+            data.pop(key,None)
+          with open(tempname,'w',encoding='utf-8') as fh:
+            json.dump(data,fh)
+          os.replace(tempname,self.filename)
+      except OSError as e:
+        tts.logger().error("Unable to write %s (%s)" % (self.filename,e))
+        return False
+      self._data=data
+      self._changes={}
+      self._removed=set()
+      self._dirty=False
+      return True
@@ -1,12 +1,48 @@
 import os.path
+import ntpath
 import string
 import json
 import tts.logger
 import tts.save
 import codecs
+import collections
+import mmap
+import re
+import time
+import functools
 from enum import IntEnum
+try:
+  import orjson
+except ImportError:
+  orjson = None
 from .filesystem import FileSystem,standard_basepath
 
+# Encodings tried, in order, for json files without a byte order mark.
+JSON_ENCODINGS=['utf-8', 'windows-1250', 'windows-1252']
+# utf-32 first, as its little endian mark starts with utf-16's.
+JSON_BOMS=[(codecs.BOM_UTF32_LE,'utf-32'),(codecs.BOM_UTF32_BE,'utf-32'),
+           (codecs.BOM_UTF8,'utf-8-sig'),
+           (codecs.BOM_UTF16_LE,'utf-16'),(codecs.BOM_UTF16_BE,'utf-16')]
+# json files at least this big are memory mapped rather than read.
+MMAP_THRESHOLD=16*1024*1024
+
+# How a json file was loaded; see json_load_info.
+JsonLoadInfo=collections.namedtuple('JsonLoadInfo',['size','encoding','backend','mapped','seconds'])
+# filename -> JsonLoadInfo for every file loaded by load_json_file.
+json_load_info={}
+
+# How much of a save to read when looking for its SaveName.
+SAVE_NAME_PREFIX=64*1024
+
+# bytes.translate table of the characters strip_filename drops. Anything
+# outside ascii is dropped by encoding first.
+_STRIP_DELETE=bytes(c for c in range(128) if chr(c) not in string.ascii_letters+string.digits)
+
+_whitespace=re.compile(r'[ \t\n\r]*')
+_json_decoder=json.JSONDecoder()
+# filename -> ((mtime,size),SaveName)
+_save_name_cache={}
+
 class SaveType(IntEnum):
   workshop = 1
   save = 2
@@ -15,10 +51,10 @@ class SaveType(IntEnum):
 def get_default_fs():
   return FileSystem(standard_basepath())
 
+@functools.lru_cache(maxsize=65536)
 def strip_filename(filename):
   # Convert a filename to TTS format.
-  valid_chars = "%s%s" % (string.ascii_letters, string.digits)
-  return ''.join(c for c in filename if c in valid_chars)
+  return filename.encode('ascii','ignore').translate(None,_STRIP_DELETE).decode('ascii')
 
 def validate_metadata(metadata, maxver):
   # TODO: extract into new class
@@ -28,6 +64,41 @@ def validate_metadata(metadata, maxver):
           'Id' in metadata and
           'Type' in metadata and metadata['Type'] in [x.name for x in SaveType])
 
+def sniff_encodings(data):
+  """The encodings to try for json data, given at least its first 4 bytes."""
+  for bom,encoding in JSON_BOMS:
+    if data[:len(bom)]==bom:
+      return [encoding]
+  return JSON_ENCODINGS
+
+def decode_json(data):
+  """Decode json from a bytes-like object, trying each likely encoding.
+
+  Returns (json,encoding,backend), or (None,None,None) if no encoding fits."""
+  log=tts.logger()
+  encodings=sniff_encodings(data)
+  tried_orjson=False
+  if orjson and encodings[0]=='utf-8':
+    # orjson validates utf-8 itself, so there is no need to decode first.
+    tried_orjson=True
+    try:
+      return orjson.loads(data),'utf-8','orjson'
+    except orjson.JSONDecodeError as e:
+      log.debug("orjson unable to parse (%s), falling back." % e)
+  for encoding in encodings:
+    try:
+      text=codecs.decode(data,encoding)
+    except UnicodeDecodeError:
+      log.debug("Unable to parse in encoding %s." % encoding)
+      continue
+    if orjson and not (tried_orjson and encoding=='utf-8'):
+      try:
+        return orjson.loads(text),encoding,'orjson'
+      except orjson.JSONDecodeError as e:
+        log.debug("orjson unable to parse (%s), falling back." % e)
+    return json.loads(text),encoding,'json'
+  return None,None,None
+
 def load_json_file(filename):
   log=tts.logger()
   if not filename:
@@ -37,73 +108,180 @@ def load_json_file(filename):
     log.error("Unable to find requested file %s" % filename)
     return None
   log.info("loading json file %s" % filename)
-  encodings = ['utf-8', 'windows-1250', 'windows-1252', 'ansi']
-  data=None
-  for encoding in encodings:
-    try:
-      data=codecs.open(filename,'r',encoding).read()
-    except UnicodeDecodeError as e:
-      log.debug("Unable to parse in encoding %s." % encoding)
-    else:
-      log.debug("loaded using encoding %s." % encoding)
-      break
-  if not data:
+  start=time.perf_counter()
+  size=os.path.getsize(filename)
+  mapped=size>=MMAP_THRESHOLD
+  j_data,encoding,backend=None,None,None
+  # The file is read exactly once, whichever encoding it turns out to be.
+  with open(filename,'rb') as fh:
+    if mapped:
+      with mmap.mmap(fh.fileno(),0,access=mmap.ACCESS_READ) as mm:
+        with memoryview(mm) as view:
+          j_data,encoding,backend=decode_json(view)
+    elif size:
+      j_data,encoding,backend=decode_json(fh.read())
+  if not encoding:
     log.error("Unable to find encoding for %s." % filename)
     return None
-  j_data=json.loads(data)
+  info=JsonLoadInfo(size,encoding,backend,mapped,time.perf_counter()-start)
+  json_load_info[filename]=info
+  log.debug("loaded using encoding {} with {}{} in {:.3f}s.".format(
+    encoding,backend," (mapped)" if mapped else "",info.seconds))
   return j_data
 
+def decode_prefix(data):
+  """Decode the first part of a json file, which may end mid-character."""
+  for encoding in sniff_encodings(data):
+    try:
+      return codecs.getincrementaldecoder(encoding)().decode(data,final=False)
+    except UnicodeDecodeError:
+      pass
+  return None
+
+def scan_save_name(text):
+  """Find the top level SaveName in the text of a save.
+
+  Only the members before SaveName (normally none) are decoded. Returns
+  None if it can't be found in text."""
+  try:
+    idx=_whitespace.match(text,0).end()
+    if text[idx:idx+1]!='{':
+      return None
+    idx+=1
+    while True:
+      idx=_whitespace.match(text,idx).end()
+      if text[idx:idx+1]!='"':
+        return None
+      key,idx=json.decoder.scanstring(text,idx+1)
+      idx=_whitespace.match(text,idx).end()
+      if text[idx:idx+1]!=':':
+        return None
+      idx=_whitespace.match(text,idx+1).end()
+      value,idx=_json_decoder.raw_decode(text,idx)
+      if key=='SaveName':
+        return value
+      idx=_whitespace.match(text,idx).end()
+      if text[idx:idx+1]!=',':
+        return None
+      idx+=1
+  except ValueError:
+    return None
+
+def read_save_name(filename):
+  """Return the SaveName of a save, reading as little of it as possible.
+
+  Results are cached by the file's mtime and size. Raises ValueError or
+  KeyError if the save can't be read or has no SaveName."""
+  stat=os.stat(filename)
+  signature=(stat.st_mtime_ns,stat.st_size)
+  cached=_save_name_cache.get(filename)
+  if cached and cached[0]==signature:
+    return cached[1]
+  with open(filename,'rb') as fh:
+    text=decode_prefix(fh.read(SAVE_NAME_PREFIX))
+  name=None
+  if text is not None:
+    name=scan_save_name(text)
+  if name is None:
+    tts.logger().debug("No SaveName near the start of %s, reading whole file." % filename)
+    data=load_json_file(filename)
+    if not isinstance(data,dict):
+      raise ValueError("Unable to read save %s" % filename)
+    name=data['SaveName']
+  _save_name_cache[filename]=(signature,name)
+  return name
+
+def read_file_infos(filesystem,save_type):
+  """Read the names TTS has recorded for saves of save_type.
+
+  Returns (mtime,names) where names maps id to name, and mtime is when the
+  index was written; saves modified after that may have been renamed."""
+  log=tts.logger()
+  filename=filesystem.get_info_filename(save_type)
+  if not filename or not os.path.isfile(filename):
+    return None,{}
+  mtime=os.stat(filename).st_mtime
+  names={}
+  try:
+    infos=load_json_file(filename)
+  except ValueError as e:
+    log.warn("Unable to read %s (%s)" % (filename,e))
+    return None,{}
+  if not isinstance(infos,list):
+    return None,{}
+  for info in infos:
+    if not isinstance(info,dict) or 'Directory' not in info or 'Name' not in info:
+      continue
+    # Written by TTS, so probably a Windows path.
+    ident=ntpath.splitext(ntpath.basename(info['Directory']))[0]
+    names[ident]=info['Name']
+  return mtime,names
+
 def load_file_by_type(ident,filesystem,save_type):
   filename=filesystem.get_json_filename_for_type(ident,save_type)
   return load_json_file(filename)
 
-def describe_files_by_type(filesystem, save_type, sort_key=lambda mod: mod[0]):
+def describe_files_by_type(filesystem, save_type, sort_key=lambda mod: mod[0], catalog=None, jobs=1):
   """ filesystem - a filesystem object
       save_type - list only mods of type defined by SaveType enum
       sort_key - None or function for defining sort order. Defaults to sort by name
+      catalog - optional Catalog to answer from instead of reading every file
+      jobs - number of processes the catalog may use to re-read changed saves
 
       return - List of (name, id)
   """
   assert isinstance(save_type, SaveType), "save_type must be a SaveType enum"
-  output=[]
-  for filename in filesystem.get_filenames_by_type(save_type):
-    json=load_file_by_type(filename,filesystem,save_type)
-    name=json['SaveName']
-    output.append((name,filename))
+  if catalog:
+    output=catalog.describe(save_type,jobs)
     if sort_key:
       output = sorted(output, key=sort_key)
+    return output
+  output=[]
+  info_mtime,names=read_file_infos(filesystem,save_type)
+  for ident in filesystem.get_filenames_by_type(save_type):
+    filename=filesystem.get_json_filename_for_type(ident,save_type)
+    if ident in names and os.stat(filename).st_mtime<=info_mtime:
+      name=names[ident]
+    else:
+      name=read_save_name(filename)
+    output.append((name,ident))
+  if sort_key:
+    output = sorted(output, key=sort_key)
   return output
 
-def download_file(filesystem,ident,save_type):
-  """Attempt to download all files for a given savefile"""
+def download_file(filesystem,ident,save_type,downloader=None,catalog=None):
+  """Attempt to download all files for a given savefile.
+
+  Returns a DownloadResults; its error is set if the save couldn't be read."""
   log=tts.logger()
   log.info("Downloading %s file %s (from %s)" % (save_type.name,ident,filesystem))
+  results=tts.DownloadResults()
+  if catalog:
+    save=catalog.load_save(ident,save_type)
+    if not save:
+      results.error="Unable to read data file for %s." % ident
+      return results
+    return download_save(save,downloader)
   filename=filesystem.get_json_filename_for_type(ident,save_type)
   if not filename:
     log.error("Unable to find data file.")
-    return False
-  try:
-    data=load_json_file(filename)
-  except IOError as e:
-    log.error("Unable to read data file %s (%s)" % (filename,e))
-    return False
-  if not data:
-    log.error("Unable to read data file %s" % filename)
-    return False
+    results.error="Unable to find data file for %s." % ident
+    return results
+  save=tts.Save.from_file(filename,ident,filesystem,save_type)
+  if not save:
+    results.error="Unable to read data file %s" % filename
+    return results
+  return download_save(save,downloader)
 
-  save=tts.Save(savedata=data,
-            filename=filename,
-            ident=ident,
-            save_type=save_type,
-            filesystem=filesystem)
-
-  if save.isInstalled:
+def download_save(save,downloader=None):
+  log=tts.logger()
+  if save.isInstalled and not (downloader and downloader.refresh):
     log.info("All files already downloaded.")
-    return True
+    return tts.DownloadResults()
 
-  successful = save.download()
-  if successful:
+  results = save.download(downloader)
+  if results.successful:
     log.info("All files downloaded.")
   else:
     log.info("Some files failed to download.")
-  return successful
+  return results
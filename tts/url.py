@@ -1,11 +1,18 @@
-import urllib.request
 import urllib.error
 import http.client
 import imghdr
+import os
+import json
+import socket
+import threading
 import tts
+from .filelock import FileLock
 from socket import error as SocketError
 
 
+# Size of the blocks downloads are streamed to disk in.
+CHUNK_SIZE=64*1024
+
 # fix jpeg detection
 def test_jpg(h,f):
   """binary jpg"""
@@ -14,23 +21,169 @@ def test_jpg(h,f):
 
 imghdr.tests.append(test_jpg)
 
+def remove_partial(filename):
+  """Remove a partial download and its info file."""
+  for name in [filename,filename+'.json']:
+    try:
+      os.remove(name)
+    except OSError:
+      pass
+
+def is_http(response):
+  """Did response come from an HTTP server? urllib's ftp responses have no
+  status, so they can't be validated or resumed."""
+  return isinstance(getattr(response,'status',None),int)
+
+def validator_header(response,name):
+  """The ETag or Last-Modified header of response, or None."""
+  return response.headers.get(name) if is_http(response) else None
+
+def partial_info(url,response,received):
+  """The validators needed to resume a download of response later."""
+  etag=validator_header(response,'ETag')
+  if etag and etag.startswith('W/'):
+    # Weak validators can't be used with If-Range.
+    etag=None
+  return {
+    'url':url,
+    'etag':etag,
+    'last_modified':validator_header(response,'Last-Modified'),
+    'received':received
+  }
+
+def load_partial_info(tempname,url):
+  """Return the info saved with a resumable partial download of url, or None."""
+  try:
+    with open(tempname+'.json','r',encoding='utf-8') as fh:
+      info=json.load(fh)
+  except (OSError,ValueError):
+    return None
+  if not isinstance(info,dict) or info.get('url')!=url:
+    return None
+  if not info.get('etag') and not info.get('last_modified'):
+    return None
+  return info
+
+def save_partial_info(tempname,info):
+  try:
+    with open(tempname+'.json','w',encoding='utf-8') as fh:
+      json.dump(info,fh)
+  except OSError as e:
+    tts.logger().debug("Unable to save partial download info %s (%s)" % (tempname,e))
+
+class _Flight:
+  """A download in progress, which other callers can wait for."""
+  def __init__(self):
+    self.done=threading.Event()
+    self.result=False
+    self.last_error=None
+    self.unchanged=False
+
+# stripped name -> _Flight, for downloads in progress in this process
+_flights={}
+_flights_lock=threading.Lock()
+
+def failure_class(error):
+  """A short description of why a download failed, as recorded by DeadUrls."""
+  if isinstance(error,urllib.error.HTTPError):
+    return "http %d" % error.code
+  if isinstance(error,urllib.error.URLError):
+    error=error.reason
+  if isinstance(error,socket.gaierror):
+    return "dns"
+  if isinstance(error,(socket.timeout,TimeoutError)):
+    return "timeout"
+  if isinstance(error,ConnectionError):
+    return "connection"
+  if isinstance(error,http.client.HTTPException):
+    return "protocol"
+  return "error"
+
 class Url:
-  def __init__(self,url,filesystem):
+  # A large save has thousands of these.
+  __slots__=('url','stripped_url','filesystem','last_error','unchanged','_isImage','_looked_for_location','_location')
+
+  def __init__(self,url,filesystem,resolution=None):
+    """resolution is an optional filesystem.Resolution of url, saving a
+    separate lookup (see FileSystem.resolve_many)."""
     self.url = url
-    self.stripped_url=tts.strip_filename(url)
     self.filesystem = filesystem
-    self._isImage=None
-    self._looked_for_location=False
-    self._location=None
+    # failure_class of the last failed download, if it failed remotely.
+    self.last_error=None
+    # Set when a refresh found the cached file was still current.
+    self.unchanged=False
+    if resolution:
+      self.stripped_url=resolution.stripped
+      self._location=resolution.location
+      self._isImage=resolution.is_image
+      self._looked_for_location=True
+    else:
+      self.stripped_url=tts.strip_filename(url)
+      self._isImage=None
+      self._looked_for_location=False
+      self._location=None
 
   def examine_filesystem(self):
     if not self._looked_for_location:
       self._location,self._isImage=self.filesystem.find_details(self.url)
       self._looked_for_location=True
 
-  def download(self):
+  def download(self,pool=None,refresh=False):
+    """Download this url into the cache, reusing connections from pool
+    (by default the shared tts.connection pool).
+
+    An interrupted download is kept in the partial directory, and resumed
+    with a Range request next time if the server supplied a validator.
+
+    If refresh is set, a file which is already cached is downloaded again
+    if it has changed. Validators saved from the last download are sent
+    so an unchanged file costs only a 304 response, and sets unchanged.
+
+    Only one download of a cache file runs at once: a call made while
+    another thread is fetching the same stripped name waits for, and
+    returns, its result. A lock file in the partial directory does the
+    same between processes."""
+    with _flights_lock:
+      flight=_flights.get(self.stripped_url)
+      leader=flight is None
+      if leader:
+        flight=_flights[self.stripped_url]=_Flight()
+    if not leader:
+      tts.logger().debug("Waiting for download of %s in progress." % self.stripped_url)
+      flight.done.wait()
+      self._looked_for_location=False
+      self.last_error=flight.last_error
+      self.unchanged=flight.unchanged
+      return flight.result
+    try:
+      lock=FileLock(self.filesystem.get_partial_path(self.stripped_url+'.lock'))
+      try:
+        waited=lock.acquire()
+      except OSError as e:
+        tts.logger().error("Unable to lock %s (%s)" % (lock.filename,e))
+        return False
+      try:
+        if waited:
+          # Another process had it; its file may not be in our index yet.
+          self.filesystem.refresh_index()
+        self._looked_for_location=False
+        flight.result=self._download(pool,refresh)
+      finally:
+        lock.release()
+      flight.last_error=self.last_error
+      flight.unchanged=self.unchanged
+    finally:
+      with _flights_lock:
+        del _flights[self.stripped_url]
+      flight.done.set()
+    return flight.result
+
+  def _download(self,pool,refresh):
     log=tts.logger()
-    if self.exists:
+    self.last_error=None
+    self.unchanged=False
+    previous=self.location
+    if previous and not refresh:
       return True
     url=self.url
     protocols=url.split('://')
@@ -38,21 +191,104 @@ class Url:
       log.warn("Missing protocol for {}. Assuming http://.".format(url))
       url = "http://" + url
     log.info("Downloading data for %s." % url)
-    user_agent = 'Mozilla/4.0 (compatible; MSIE 5.5; Windows NT)'
-    headers = { 'User-Agent' : user_agent }
-    request=urllib.request.Request(url,headers=headers)
+    if pool is None:
+      pool=tts.connection.default_pool()
+    tempname=self.filesystem.get_partial_path(self.stripped_url+'.part')
+    headers={}
+    validators=self.filesystem.validators()
+    if previous:
+      known=validators.get(self.stripped_url)
+      if known and known.get('url')==url:
+        if known.get('etag'):
+          headers['If-None-Match']=known['etag']
+        if known.get('last_modified'):
+          headers['If-Modified-Since']=known['last_modified']
+    offset=0
+    info=load_partial_info(tempname,url)
+    if info:
+      try:
+        offset=os.path.getsize(tempname)
+      except OSError:
+        offset=0
+      if offset:
+        log.info("Resuming %s from byte %d." % (url,offset))
+        headers['Range']='bytes=%d-' % offset
+        headers['If-Range']=info['etag'] or info['last_modified']
     try:
-      response=urllib.request.urlopen(request)
-    except (urllib.error.URLError,SocketError) as e:
+      response=pool.open(url,headers)
+    except urllib.error.HTTPError as e:
+      if e.code==304 and ('If-None-Match' in headers or 'If-Modified-Since' in headers):
+        # urllib (used with proxies) reports a 304 as an error.
+        e.close()
+        log.info("%s is unchanged." % url)
+        self.unchanged=True
+        return True
+      if e.code==416 and offset:
+        log.info("Unable to resume %s, starting again." % url)
+        remove_partial(tempname)
+        return self._download(pool,refresh)
       log.error("Error downloading %s (%s)" % (url,e))
+      self.last_error=failure_class(e)
       return False
-    try:
-      data=response.read()
-    except http.client.IncompleteRead as e:
-      #This error is the http server did not return the whole file
+    except (urllib.error.URLError,http.client.HTTPException,SocketError) as e:
       log.error("Error downloading %s (%s)" % (url,e))
+      self.last_error=failure_class(e)
       return False
-    imagetype=imghdr.what('',data)
+    with response:
+      if getattr(response,'status',None)==304:
+        response.read()
+        log.info("%s is unchanged." % url)
+        self.unchanged=True
+        return True
+      validator={
+        'url':url,
+        'etag':validator_header(response,'ETag'),
+        'last_modified':validator_header(response,'Last-Modified')
+      }
+      resuming=offset and getattr(response,'status',None)==206
+      if resuming and not (response.headers.get('Content-Range') or '').startswith('bytes %d-' % offset):
+        # Not the part we asked for; it can't be appended or used as the whole file.
+        log.warn("Server sent the wrong range for %s, starting again." % url)
+        response.close()
+        remove_partial(tempname)
+        return self._download(pool,refresh)
+      if offset and not resuming:
+        log.info("Server ignored range request for %s, downloading in full." % url)
+      info=partial_info(url,response,offset if resuming else 0)
+      length=response.headers.get('Content-Length')
+      expected=info['received']+int(length) if length and length.isdigit() else None
+      # Stream into a temporary file and only move it into place once it is
+      # complete, so a failed download never looks like an installed file.
+      try:
+        os.makedirs(os.path.dirname(tempname),exist_ok=True)
+        save_partial_info(tempname,info)
+        with open(tempname,'r+b' if resuming else 'wb') as fh:
+          fh.seek(info['received'])
+          fh.truncate()
+          data=response.read(CHUNK_SIZE)
+          while data:
+            fh.write(data)
+            info['received']+=len(data)
+            data=response.read(CHUNK_SIZE)
+        # read(amt) doesn't complain if the connection closes early.
+        if expected is not None and info['received']<expected:
+          raise http.client.IncompleteRead(b'',expected-info['received'])
+      except (http.client.HTTPException,ConnectionError,TimeoutError) as e:
+        #This error is the http server did not return the whole file
+        log.error("Error downloading %s (%s)" % (url,e))
+        self.last_error=failure_class(e)
+        if info['etag'] or info['last_modified']:
+          log.info("Keeping %d bytes of %s to resume later." % (info['received'],url))
+          save_partial_info(tempname,info)
+        else:
+          remove_partial(tempname)
+        return False
+      except IOError as e:
+        log.error("Error writing file %s (%s)" % (tempname,e))
+        remove_partial(tempname)
+        return False
+    # Only the start of the file is needed to recognise image formats.
+    imagetype=imghdr.what(tempname)
     filename=None
     if imagetype==None:
       filename=self.filesystem.get_model_path(self.stripped_url+'.obj')
@@ -63,12 +299,23 @@ class Url:
       log.debug("File is %s" % imagetype)
       filename=self.filesystem.get_image_path(self.stripped_url+'.'+imagetype)
     try:
-      fh=open(filename,'wb')
-      fh.write(data)
-      fh.close()
-    except IOError as e:
+      os.replace(tempname,filename)
+    except OSError as e:
       log.error("Error writing file %s (%s)" % (filename,e))
+      remove_partial(tempname)
       return False
+    remove_partial(tempname+'.json')
+    if previous and previous!=filename:
+      # The file changed type; don't leave the old one to shadow it.
+      try:
+        os.remove(previous)
+      except OSError as e:
+        log.warn("Unable to remove old file %s (%s)" % (previous,e))
+    if validator['etag'] or validator['last_modified']:
+      validators.set(self.stripped_url,validator)
+    else:
+      validators.pop(self.stripped_url)
+    self.filesystem.index_file(filename)
     self._looked_for_location=False
     return True
 
@@ -9,6 +9,15 @@ import _io
 import json
 import zipfile
 import logging
+import multiprocessing
+import threading
+
+def timeout(value):
+  """argparse type for a number of seconds to wait; 0 would never wait at all."""
+  seconds=float(value)
+  if not seconds>0:
+    raise argparse.ArgumentTypeError("timeout must be more than 0 seconds: %s" % value)
+  return seconds
 
 class TTS_CLI:
   def __init__(self):
@@ -17,6 +26,9 @@ class TTS_CLI:
     parser = argparse.ArgumentParser(description="Manipulate Tabletop Simulator files")
     parser.add_argument("-d","--directory",help="Override TTS cache directory")
     parser.add_argument("-l","--loglevel",help="Set logging level",choices=['debug','info','warn','error'])
+    parser.add_argument("--jobs",type=int,default=1,help="Number of processes to use when reading many saves, and of threads when importing (default %(default)s).")
+    parser.add_argument("--catalog",action="store_true",help="Use a persistent catalog of saves and assets to avoid rereading unchanged files.")
+    parser.add_argument("--catalog-file",help="Location of the catalog (implies --catalog).")
     subparsers = parser.add_subparsers(dest='parser',title='command',description='Valid commands.')
     subparsers.required=True
 
@@ -44,11 +56,15 @@ class TTS_CLI:
     parser_export.add_argument("-o","--output",help="Location/file to export to.")
     parser_export.add_argument("-f","--force",action="store_true",help="Force creation of export file.")
     parser_export.add_argument("-d","--download",action="store_true",help="Attempt to download missing cache files. (EXPERIMENTAL)")
+    parser_export.add_argument("--compression",choices=list(tts.pak.COMPRESSION_METHODS),default=tts.pak.DEFAULT_COMPRESSION,help="How to compress files other than images (default %(default)s).")
+    parser_export.add_argument("--level",type=int,choices=range(10),metavar="0-9",help="Compression level (default %d)." % tts.pak.DEFAULT_LEVEL)
     parser_export.set_defaults(func=self.do_export)
 
     # import command
     parser_import = subparsers.add_parser('import',help="Import a mod.",description="Import an previously exported mod.")
     parser_import.add_argument("file",help="Mod pak file to import.")
+    parser_import.add_argument("-i","--incremental",action="store_true",help="Only write files which are missing or differ from those already installed.")
+    parser_import.add_argument("-n","--dry-run",action="store_true",help="Show what an incremental import would write, without writing anything.")
     parser_import.set_defaults(func=self.do_import)
 
     # download command
@@ -60,6 +76,16 @@ class TTS_CLI:
     group_download_target=parser_download.add_mutually_exclusive_group(required=True)
     group_download_target.add_argument("-a","--all",action="store_true",help="Download all.")
     group_download_target.add_argument("id",nargs='?',help="ID of mod/name of savegame to download.")
+    parser_download.add_argument("-j","--workers",type=int,default=tts.download.DEFAULT_WORKERS,help="Number of files to download at once (default %(default)s).")
+    parser_download.add_argument("--per-host",type=int,default=tts.download.DEFAULT_PER_HOST,help="Maximum simultaneous downloads from one host (default %(default)s).")
+    parser_download.add_argument("--first",action="append",metavar="ID",help="With --all, download the files of this mod before any others. May be repeated; while downloading, typing an id and pressing enter does the same.")
+    parser_download.add_argument("--probe-sizes",action="store_true",help="Ask servers for file sizes first, so small files can be downloaded first. Without it, only files already cached (with --refresh and --catalog) are ordered by size.")
+    parser_download.add_argument("--refresh",action="store_true",help="Download cached files again if they have changed on the server.")
+    parser_download.add_argument("--retry-dead",action="store_true",help="Retry urls which failed recently instead of skipping them.")
+    parser_download.add_argument("--connect-timeout",type=timeout,help="Seconds to wait for a connection (default from config, %s)." % tts.connection.DEFAULT_CONNECT_TIMEOUT)
+    parser_download.add_argument("--read-timeout",type=timeout,help="Seconds to wait for data from a server (default from config, %s)." % tts.connection.DEFAULT_READ_TIMEOUT)
+    parser_download.add_argument("--retries",type=int,help="Further attempts after a transient failure (default from config, %s)." % tts.download.DEFAULT_RETRIES)
+    parser_download.add_argument("--breaker-threshold",type=int,help="Failures in a row before giving up on a host, 0 for never (default from config, %s)." % tts.download.DEFAULT_BREAKER_THRESHOLD)
     parser_download.set_defaults(func=self.do_download)
 
     # cache command
@@ -83,6 +109,10 @@ class TTS_CLI:
     parser_config_set.set_defaults(func=self.do_config_set)
     parser_config_set.add_argument("-m","--mod_location",choices=['documents','gamedata'],help="Where mods are stored.")
     parser_config_set.add_argument("-t","--tts_location",help="TTS Install directory")
+    parser_config_set.add_argument("--connect-timeout",type=timeout,help="Seconds to wait for a connection.")
+    parser_config_set.add_argument("--read-timeout",type=timeout,help="Seconds to wait for data from a server.")
+    parser_config_set.add_argument("--retries",type=int,help="Further attempts after a transient download failure.")
+    parser_config_set.add_argument("--breaker-threshold",type=int,help="Failures in a row before giving up on a host, 0 for never.")
 
     args = parser.parse_args()
 
@@ -104,12 +134,18 @@ class TTS_CLI:
     else:
       self.filesystem = self.preferences.get_filesystem()
 
+    self.jobs=args.jobs
+    self.catalog=None
+    if args.catalog or args.catalog_file:
+      self.catalog=tts.Catalog(self.filesystem,args.catalog_file)
+
     if (args.parser=='list' or args.parser=='export') and not args.save_type:
       # set default
       args.save_type = tts.SaveType.workshop
 
-    if (args.parser=='config' and args.parser_config=='set' and not args.mod_location and not args.tts_location):
-      parser_config_set.error("At least one of -m or -t is required.")
+    if (args.parser=='config' and args.parser_config=='set' and not args.mod_location and not args.tts_location and
+        all(getattr(args,name) is None for name in ['connect_timeout','read_timeout','retries','breaker_threshold'])):
+      parser_config_set.error("At least one option is required.")
 
     rc,message = args.func(args)
     if message:
@@ -121,6 +157,14 @@ class TTS_CLI:
       self.preferences.locationIsUser = args.mod_location=='documents'
     if args.tts_location:
       self.preferences.TTSLocation=args.mod_location
+    if args.connect_timeout is not None:
+      self.preferences.connectTimeout=args.connect_timeout
+    if args.read_timeout is not None:
+      self.preferences.readTimeout=args.read_timeout
+    if args.retries is not None:
+      self.preferences.retries=args.retries
+    if args.breaker_threshold is not None:
+      self.preferences.breakerThreshold=args.breaker_threshold
     self.preferences.save()
     return 0,"Preferences set"
 
@@ -146,42 +190,69 @@ class TTS_CLI:
 
   def list_by_type(self,save_type):
     result=""
-    for (name,id) in tts.describe_files_by_type(self.filesystem,save_type):
+    for (name,id) in tts.describe_files_by_type(self.filesystem,save_type,catalog=self.catalog,jobs=self.jobs):
       result+="\n%s (%s)" % (name,id)
     return 0,result
 
-  def list_item(self,data,filename,ident):
-    if not data:
-      self.list_installed()
+  def scan_saves(self,save_types):
+    """Yield a Save for every save of the given types, without keeping their json."""
+    if self.catalog:
+      for save_type in save_types:
+        for ident,(filename,name,urls) in self.catalog.refresh_saves(save_type,self.jobs).items():
+          yield tts.Save(savedata=None,filename=filename,ident=ident,save_type=save_type,
+                         filesystem=self.filesystem,save_name=name,urls=urls)
       return
-    save=tts.Save(savedata=data,ident=ident,filename=filename,filesystem=self.filesystem)
-    return 0,save
+    for result in tts.scan.scan_library(self.filesystem,save_types,self.jobs):
+      yield tts.Save(savedata=None,filename=result.filename,ident=result.ident,save_type=result.save_type,
+                     filesystem=self.filesystem,save_name=result.name,urls=result.urls)
 
   def do_download(self,args):
-    successful=True
+    downloader=self.preferences.get_downloader(connect_timeout=args.connect_timeout,
+                                               read_timeout=args.read_timeout,
+                                               retries=args.retries,
+                                               breaker_threshold=args.breaker_threshold,
+                                               workers=args.workers,
+                                               per_host=args.per_host,
+                                               retry_dead=args.retry_dead,
+                                               refresh=args.refresh,
+                                               catalog=self.catalog,
+                                               probe_sizes=args.probe_sizes)
     if not args.all:
       if not args.save_type:
         args.save_type=self.filesystem.get_json_filename_type(args.id)
       if not args.save_type:
         return 1,"Unable to determine type of id %s" % args.id
-      successful = tts.download_file(self.filesystem,args.id,args.save_type)
+      results = tts.download_file(self.filesystem,args.id,args.save_type,downloader,self.catalog)
+      successful = results.successful
+      summary = results.summary()
     else:
-      if args.save_type:
-        for ident in self.filesystem.get_filenames_by_type(args.save_type):
-          if not tts.download_file(self.filesystem,ident,args.save_type):
-            successful=False
-            break
-      else:
-        for save_type in tts.SaveType:
-          for ident in self.filesystem.get_filenames_by_type(save_type):
-            if not tts.download_file(self.filesystem,ident,save_type):
-              successful=False
-              break
-
+      save_types=[args.save_type] if args.save_type else list(tts.SaveType)
+      plan=tts.DownloadPlan(self.filesystem,refresh=args.refresh)
+      for save in self.scan_saves(save_types):
+        plan.add(save)
+      for ident in args.first or []:
+        plan.prioritise(ident)
+      if sys.stdin.isatty():
+        self.watch_priorities(plan)
+      report=plan.run(downloader)
+      successful=report.successful
+      summary=str(report)
+
+    if self.catalog:
+      self.catalog.refresh_assets()
     if successful:
-      return 0, "All files downloaded."
+      return 0, "All files downloaded: %s" % summary
     else:
-      return 1, "Some files failed to download."
+      return 1, "Some files failed to download: %s" % summary
+
+  def watch_priorities(self,plan):
+    """Prioritise each mod id typed in while plan runs."""
+    def watch():
+      for line in sys.stdin:
+        if line.strip():
+          plan.prioritise(line.strip())
+    print("Type a mod id and press enter to download it next.",file=sys.stderr)
+    threading.Thread(target=watch,daemon=True).start()
 
   def do_list(self,args):
     rc=0
@@ -194,9 +265,18 @@ class TTS_CLI:
         args.save_type=self.filesystem.get_json_filename_type(args.id)
       if not args.save_type:
         return 1,"Unable to determine type of id %s" % args.id
+      if self.catalog:
+        save=self.catalog.load_save(args.id,args.save_type)
+        if not save:
+          return 1,"Unable to load data for id %s" % args.id
+        return 0,save
       filename=self.filesystem.get_json_filename_for_type(args.id,args.save_type)
-      data=tts.load_json_file(filename)
-      rc,result=self.list_item(data,filename,args.id)
+      if not filename:
+        return 1,"Unable to find filename for id %s" % args.id
+      save=tts.Save.from_file(filename,args.id,self.filesystem,args.save_type)
+      if not save:
+        return 1,"Unable to load data for id %s" % args.id
+      rc,result=0,save
     return rc,result
 
   def do_export(self,args):
@@ -220,15 +300,14 @@ class TTS_CLI:
 
     if not json_filename:
       return 1, "Unable to find filename for id %s (wrong -s/-w/-c specified?)" % args.id
-    data=tts.load_json_file(json_filename)
-    if not data:
-      return 1, "Unable to load data for file %s" % json_filename
-
-    save=tts.Save(savedata=data,
-                  filename=json_filename,
-                  ident=args.id,
-                  save_type=args.save_type,
-                  filesystem=self.filesystem)
+    if self.catalog:
+      save=self.catalog.load_save(args.id,args.save_type)
+      if not save:
+        return 1, "Unable to load data for file %s" % json_filename
+    else:
+      save=tts.Save.from_file(json_filename,args.id,self.filesystem,args.save_type)
+      if not save:
+        return 1, "Unable to load data for file %s" % json_filename
     if not save.isInstalled:
       if not args.download:
           if not args.force:
@@ -237,25 +316,32 @@ class TTS_CLI:
             print(f"WARN: Unable to find all urls required by {args.id}. Force option provided, proceeding anyway.")
       else:
         tts.logger().info("Downloading missing files...")
-        successful = save.download()
-        if successful:
+        results = save.download(self.preferences.get_downloader())
+        if results.successful:
           tts.logger().info("Files downloaded successfully.")
         else:
           return 1, "Some files failed to download"
     if os.path.isfile(filename) and not args.force:
       return 1,"%s already exists. Please specify another file or use '-f'" % filename
     tts.logger().info("Exporting json file %s to %s" % (args.id,filename))
-    save.export(filename)
+    stats=save.export(filename,args.compression,args.level)
     # TODO: exception handling
-    return 0,"Exported %s to %s" % (args.id,filename)
+    return 0,"Exported %s to %s (%s)" % (args.id,filename,stats)
 
   def do_import(self,args):
-    if tts.save.importPak(self.filesystem,args.file):
+    if args.dry_run:
+      plan=tts.save.planPak(self.filesystem,args.file)
+      if not plan:
+        return 1, f"Error reading {args.file}"
+      return 0, str(plan)
+    if tts.save.importPak(self.filesystem,args.file,args.incremental,self.jobs):
         return 0, f"Successfully imported {args.file} into {{TODO}}"
     else:
         return 1, f"Error importing {args.file}"
 
 if __name__ == "__main__":
+  # needed for --jobs in frozen windows builds
+  multiprocessing.freeze_support()
   # fix windows' poor unicode support
   sys.stdout=_io.TextIOWrapper(sys.stdout.buffer,sys.stdout.encoding,'replace',sys.stdout.newlines,sys.stdout.line_buffering)
   tts_cli=TTS_CLI()
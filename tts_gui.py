@@ -65,13 +65,8 @@ class SaveBrowser():
       return
     ident=self.file_store[now[0]]
     filename=self.filesystem.get_json_filename_for_type(ident,self.save_type.get())
-    data=tts.load_json_file(filename)
     # TODO: error handling
-    self.save=tts.Save(savedata=data,
-                  ident=ident,
-                  filename=filename,
-                  save_type=tts.SaveType(self.save_type.get()),
-                  filesystem=self.filesystem)
+    self.save=tts.Save.from_file(filename,ident,self.filesystem,tts.SaveType(self.save_type.get()))
     if self.save.isInstalled:
       self.status_label.config(text="All files found.")
     else:
@@ -135,14 +130,22 @@ class TTS_GUI:
     self.importEntry.insert(0,self.import_filename)
 
   def exportPak(self):
-    if not self.export_sb.save.isInstalled:
-      successful = self.export_sb.save.download()
-      if not successful:
+    save=self.export_sb.save
+    self.export_filename=self.targetEntry.get()
+    if save.isInstalled:
+      stats=save.export(self.export_filename)
+      messagebox.showinfo("TTS Manager","Export Done ({}).".format(stats))
+      return
+    self.exportButton.config(state=Tk.DISABLED)
+    downloader=self.preferences.get_downloader()
+    def done(results):
+      self.exportButton.config(state=Tk.NORMAL)
+      if not results or not results.successful:
         messagebox.showinfo("TTS Manager","Export failed (see log)")
         return
-    self.export_filename=self.targetEntry.get()
-    self.export_sb.save.export(self.export_filename)
-    messagebox.showinfo("TTS Manager","Export Done.")
+      stats=save.export(self.export_filename)
+      messagebox.showinfo("TTS Manager","Export Done ({}).".format(stats))
+    tts.runInBackground(self.root,lambda: save.download(downloader),done)
 
   def importPak(self):
     self.import_filename=self.importEntry.get()
@@ -205,6 +208,9 @@ class TTS_GUI:
     ttk.Button(importFrame,text="Import",command=self.importPak).pack()
 
   def update_download_frame_details(self,event):
+    if self.download_plan and self.download_sb.save:
+      # Whatever the user looks at during Download All is fetched next.
+      self.download_plan.prioritise(self.download_sb.save.ident)
     if self.download_sb.save.isInstalled:
       self.downloadButton.config(state=Tk.DISABLED)
     else:
@@ -215,26 +221,52 @@ class TTS_GUI:
       tts.logger().warn("Internal error: no save when attempting to download")
       messagebox.showinfo("TTS Manager","Download failed (see log).")
       return
-    if self.download_sb.save.download():
-      messagebox.showinfo("TTS Manager","Download done.")
-    else:
-      messagebox.showinfo("TTS Manager","Download failed (see log).")
+    save=self.download_sb.save
+    downloader=self.preferences.get_downloader()
+    self.downloadButton.config(state=Tk.DISABLED)
+    def done(results):
+      self.downloadButton.config(state=Tk.NORMAL)
+      if results and results.successful:
+        messagebox.showinfo("TTS Manager","Download done.")
+      else:
+        messagebox.showinfo("TTS Manager","Download failed (see log).")
+    tts.runInBackground(self.root,lambda: save.download(downloader),done)
 
   def download_all(self):
+    if self.download_plan:
+      messagebox.showinfo("TTS Manager","Already downloading. Select a mod to download it next.")
+      return
     successful=True
     save_type={1:tts.SaveType.workshop,
                2:tts.SaveType.save,
                3:tts.SaveType.chest}[self.download_sb.save_type.get()]
+    plan=tts.DownloadPlan(self.filesystem)
     for ident in self.download_sb.file_store.values():
-      successful = tts.download_file(self.filesystem,ident,save_type)
-      if not successful:
-        break
-    if successful:
+      filename=self.filesystem.get_json_filename_for_type(ident,save_type)
+      save=tts.Save.from_file(filename,ident,self.filesystem,save_type) if filename else None
+      if not save:
+        tts.logger().error("Unable to read data file for %s." % ident)
+        successful=False
+        continue
+      plan.add(save)
+    # Run in the background so the user can pick which mod to fetch next.
+    self.download_plan=plan
+    downloader=self.preferences.get_downloader()
+    tts.runInBackground(self.root,lambda: plan.run(downloader),
+                        lambda report: self.download_all_done(report,successful))
+
+  def download_all_done(self,report,successful):
+    self.download_plan=None
+    if report and report.successful and successful:
       messagebox.showinfo("TTS Manager","All files downloaded successfully.")
+    elif report:
+      tts.logger().warn(report)
+      messagebox.showinfo("TTS Manager","Some downloads failed for {} saves (see log).".format(len(report.missing)))
     else:
-      messagebox.showinfo("TTS Manager","Some downloads failed (see log).")
+      messagebox.showinfo("TTS Manager","Download failed (see log).")
 
   def populate_download_frame(self,frame):
+    self.download_plan=None
     self.download_sb=SaveBrowser(frame,self.filesystem)
     self.download_sb.bind("<<SelectionChange>>",self.update_download_frame_details)
     self.downloadButton=ttk.Button(frame,text="Download",command=self.download)
@@ -83,11 +83,16 @@ class TTS_MANAGER:
       tts.logger().warn("Internal error: self.save NULL when attempting to download")
       messagebox.showinfo("TTS Manager","Download failed (see log).")
       return
-    if self.save.download():
-      messagebox.showinfo("TTS Manager","Download done.")
-    else:
-      messagebox.showinfo("TTS Manager","Download failed (see log).")
-    self.file_list_has_changed(self.file_list_current)
+    save=self.save
+    downloader=self.preferences.get_downloader()
+    self.downloadButton.configure(state=Tk.DISABLED)
+    def done(results):
+      if results and results.successful:
+        messagebox.showinfo("TTS Manager","Download done.")
+      else:
+        messagebox.showinfo("TTS Manager","Download failed (see log).")
+      self.file_list_has_changed(self.file_list_current)
+    tts.runInBackground(self.root,lambda: save.download(downloader),done)
 
   def export(self):
     pass
@@ -104,13 +109,8 @@ class TTS_MANAGER:
       return
     ident=self.file_store[now[0]]
     filename=self.filesystem.get_json_filename_for_type(ident,self.save_type.get())
-    data=tts.load_json_file(filename)
     # TODO: error handling
-    self.save=tts.Save(savedata=data,
-                       ident=ident,
-                       filename=filename,
-                       save_type=tts.SaveType(self.save_type.get()),
-                       filesystem=self.filesystem)
+    self.save=tts.Save.from_file(filename,ident,self.filesystem,tts.SaveType(self.save_type.get()))
     if self.save.isInstalled:
       self.downloadButton.configure(text="All files Downloaded",
                                     state=Tk.DISABLED)